@@ -0,0 +1,153 @@
+"""
+Measures how the per-frame cost of the simulation scales with the size of the swarm.
+For each drone count a headless simulator spawns virtual drones on a formation (or a grid if there is no formation with that
+many points), keeps giving them random targets and records them, while the profiler measures every task. The results are
+saved as json and can be compared against a stored baseline to catch regressions. Example:
+
+    python benchmark.py --save-baseline
+    python benchmark.py --baseline benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import math
+import random
+import argparse
+import datetime
+import platform
+import multiprocessing
+
+from panda3d.core import Vec3
+
+from formations.formation_ui_element import loadFormations
+
+
+DRONECOUNTS = [2, 10, 50, 200, 1000]
+# the tasks that are compared against the baseline
+TASKS = ["UpdateDrones", "UpdatePhysics", "UpdateForces", "UpdateProximity", "UpdateTimeslot", "RecordDrones", "Frame"]
+BENCHMARKDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+
+def _spawnPositions(droneCount):
+    """Returns the points of the first formation with droneCount points, or a grid with droneCount points."""
+    for name, positions in loadFormations():
+        if len(positions) == droneCount:
+            return name, [Vec3(*position) for position in positions]
+    side = math.ceil(math.sqrt(droneCount))
+    return "grid", [Vec3((i % side - side / 2) * 0.5, (i // side - side / 2) * 0.5, 1) for i in range(droneCount)]
+
+
+def runBenchmark(droneCount, physicsBackend, frames, warmupFrames):
+    """Runs the benchmark for one drone count in a headless simulator, has to run in a fresh process."""
+    from drone_simulator import DroneSimulator
+
+    random.seed(droneCount)
+    formationName, positions = _spawnPositions(droneCount)
+    droneList = [[position, "-1"] for position in positions]
+    app = DroneSimulator(droneList, headless=True, fastForward=True, physicsBackend=physicsBackend, profile=True)
+    app.simClock.stepsPerFrame = 1  # so the cost per frame is the cost per simulation step
+
+    manager = app.droneManager
+    manager.isStarted = True
+    # grow the room with the swarm, so that the density of the drones stays the same as with 10 drones in the lab
+    manager.roomSize *= max(1, (droneCount / 10) ** (1 / 3))
+
+    def randomTargetsTask(task):
+        manager.setRandomTargets()
+        task.delayTime = 3
+        return task.again
+    app.simClock.add(randomTargetsTask, "RandomTargets")
+    app.droneRecorder.startRecording()
+
+    for _ in range(warmupFrames):
+        app.taskMgr.step()
+    app.profiler.reset()
+    for _ in range(frames):
+        app.taskMgr.step()
+
+    statistics = app.profiler.getStatistics()
+    app.finalExitCallbacks.remove(app.profiler.export)  # the results are saved by the benchmark instead
+    return {
+        "drones": droneCount,
+        "physics": physicsBackend,
+        "formation": formationName,
+        "frames": frames,
+        "tasks": {name: statistics[name] for name in TASKS if name in statistics},
+    }
+
+
+def _runBenchmarkArgs(args):
+    return runBenchmark(*args)
+
+
+def runBenchmarks(droneCounts, physicsBackends, frames=200, warmupFrames=20):
+    """Runs the benchmarks one after another, each in its own process because panda3d only allows one ShowBase per process."""
+    configurations = [(n, physics, frames, warmupFrames) for physics in physicsBackends for n in droneCounts]
+    results = []
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(_runBenchmarkArgs, configurations):
+            results.append(result)
+            frame = result["tasks"]["Frame"]
+            print(f"{result['physics']:>6} {result['drones']:>5} drones: {frame['p50']:8.2f} ms p50 {frame['p99']:8.2f} ms p99 per frame")
+    return {
+        "date": datetime.datetime.now().isoformat(),
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def compareToBaseline(results, baseline, tolerance):
+    """Prints the p50 of every task relative to the baseline and returns a list of the regressions, which are slower than tolerance times the baseline."""
+    baselineResults = {(result["drones"], result["physics"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        key = (result["drones"], result["physics"])
+        if key not in baselineResults:
+            continue
+        for name, values in result["tasks"].items():
+            if name not in baselineResults[key]["tasks"]:
+                continue
+            before = baselineResults[key]["tasks"][name]["p50"]
+            ratio = values["p50"] / before if before > 0 else 1
+            marker = ""
+            if ratio > tolerance:
+                regressions.append([key[1], key[0], name, before, values["p50"]])
+                marker = "  REGRESSION"
+            print(f"{key[1]:>6} {key[0]:>5} {name:<16}{before:9.3f} ms -> {values['p50']:9.3f} ms ({ratio:5.2f}x){marker}")
+    return regressions
+
+
+def _save(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"saved as {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drones", type=int, nargs="+", default=DRONECOUNTS, help="the drone counts")
+    parser.add_argument("--physics", nargs="+", choices=["bullet", "numpy"], default=["bullet", "numpy"], help="the physics backends")
+    parser.add_argument("--frames", type=int, default=200, help="the amount of measured frames per drone count")
+    parser.add_argument("--warmup", type=int, default=20, help="the amount of frames before measuring")
+    parser.add_argument("--output", default=None, help="the result file, defaults to benchmarks/results_<date>.json")
+    parser.add_argument("--baseline", default=None, help="a result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="the p50 ratio to the baseline that counts as a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as benchmarks/baseline.json")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.drones, args.physics, args.frames, args.warmup)
+    if args.save_baseline:
+        _save(results, os.path.join(BENCHMARKDIR, "baseline.json"))
+    else:
+        output = args.output or os.path.join(BENCHMARKDIR, "results_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".json")
+        _save(results, output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareToBaseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions found")
+            sys.exit(1)
@@ -33,7 +33,7 @@ class CameraController(DirectObject.DirectObject):
         windowSizeX = self.base.win.getProperties().getXSize()
         windowSizeY = self.base.win.getProperties().getYSize()
         self.setAnchor = True
-        self.base.taskMgr.add(self.cameraControlTask, "CameraControlTask", extraArgs=[windowSizeX, windowSizeY], appendTask=True)
+        self.base.taskMgr.add(self.base.profiler.wrapTask(self.cameraControlTask, "CameraControlTask"), "CameraControlTask", extraArgs=[windowSizeX, windowSizeY], appendTask=True)
 
 
     def deactivateCameraControl(self):
@@ -0,0 +1,190 @@
+import random
+
+import numpy as np
+
+
+class BernoulliLoss:
+    """Loses each packet independently with the same probability."""
+
+    def __init__(self, lossProbability):
+        self.lossProbability = lossProbability
+
+    def lose(self, rng, senders, receivers) -> np.ndarray:
+        """Returns which of the packets sent over the supplied links are lost."""
+        return rng.random(len(senders)) < self.lossProbability
+
+
+class GilbertElliottLoss:
+    """Loses packets in bursts. Each link is either in the good or in the bad state and switches state before every packet
+        with the supplied probabilities, the loss probability depends on the state. The mean burst length is 1 / pBadToGood."""
+
+    def __init__(self, pGoodToBad, pBadToGood, lossGood=0, lossBad=1):
+        self.pGoodToBad = pGoodToBad
+        self.pBadToGood = pBadToGood
+        self.lossGood = lossGood
+        self.lossBad = lossBad
+        self.isBad = np.zeros((0, 0), dtype=bool)  # the state of each link, indexed by sender and receiver
+
+    def lose(self, rng, senders, receivers) -> np.ndarray:
+        """Returns which of the packets sent over the supplied links are lost and advances the state of these links."""
+        size = max(np.max(senders, initial=-1), np.max(receivers, initial=-1)) + 1
+        if size > len(self.isBad):
+            isBad = np.zeros((size, size), dtype=bool)
+            isBad[:len(self.isBad), :len(self.isBad)] = self.isBad
+            self.isBad = isBad
+
+        wasBad = self.isBad[senders, receivers]
+        switch = rng.random(len(senders)) < np.where(wasBad, self.pBadToGood, self.pGoodToBad)
+        isBad = wasBad ^ switch
+        self.isBad[senders, receivers] = isBad
+        return rng.random(len(senders)) < np.where(isBad, self.lossBad, self.lossGood)
+
+
+class GaussianLatency:
+    """Delays packets by a normally distributed latency, which is never negative. Without jitter all packets take the same time."""
+
+    def __init__(self, meanMilli=0, jitterMilli=0):
+        self.meanMilli = meanMilli
+        self.jitterMilli = jitterMilli
+
+    def sample(self, rng, size) -> np.ndarray:
+        """Returns the latency of size packets in seconds."""
+        if self.jitterMilli == 0:
+            return np.full(size, self.meanMilli / 1000)
+        return np.maximum(rng.normal(self.meanMilli, self.jitterMilli, size), 0) / 1000
+
+
+class ChannelSimulator:
+    """Simulates the radio channel between each sender and each receiver of the position broadcasts.
+        A sent position reaches every other drone within maxRange unless the loss model drops it, and arrives after the latency
+        drawn from the latency model. Each drone keeps its own view of the swarm: the newest position it received from each other drone.
+        The views are stored in dense arrays, so the memory grows with the square of the swarm size.
+        The loss and latency models can be replaced by any object with the same lose() and sample() methods."""
+
+    def __init__(self, swarm, lossModel=None, latencyModel=None, maxRange=None):
+        self.swarm = swarm
+        self.lossModel = lossModel  # None means no packets are lost
+        self.latencyModel = latencyModel  # None means packets arrive within the same simulation step
+        self.maxRange = maxRange  # None means every drone can hear every other drone
+
+        # seeded from the random module, so seeding it makes the channel reproducible
+        self.rng = np.random.default_rng(random.getrandbits(32))
+
+        # receivedPositions[r, s] is the newest position drone r received from drone s, sent at receivedTimes[r, s]
+        self.capacity = 0
+        self.receivedPositions = np.zeros((0, 0, 3))
+        self.receivedTimes = np.zeros((0, 0))
+        self._allocate(max(16, swarm.count))
+
+        # the event queue of the packets that are on their way, one entry per receiver
+        self.pendingTimes = np.zeros(0)  # the time at which each packet is delivered
+        self.pendingSentTimes = np.zeros(0)
+        self.pendingSenders = np.zeros(0, dtype=int)
+        self.pendingReceivers = np.zeros(0, dtype=int)
+        self.pendingPositions = np.zeros((0, 3))
+
+        self.statistics = {"sent": 0, "delivered": 0, "lost": 0, "outOfRange": 0}
+
+
+    def resetViews(self, time=0):
+        """Lets every drone know the last sent positions of all other drones, e.g. at the start of an experiment."""
+        n = self.swarm.count
+        self._ensureCapacity(n)
+        self.receivedPositions[:n, :n] = self.swarm.lastSentPositions[:n]
+        self.receivedTimes[:n, :n] = time
+        np.fill_diagonal(self.receivedTimes, -np.inf)
+        self.pendingTimes = self.pendingTimes[:0]
+        self.pendingSentTimes = self.pendingSentTimes[:0]
+        self.pendingSenders = self.pendingSenders[:0]
+        self.pendingReceivers = self.pendingReceivers[:0]
+        self.pendingPositions = self.pendingPositions[:0]
+
+
+    def transmit(self, senders, time):
+        """Broadcasts the last sent positions of the supplied drones to all other drones at the supplied time."""
+        n = self.swarm.count
+        self._ensureCapacity(n)
+        # one link from each sender to each other drone
+        linkSenders = np.repeat(senders, n)
+        linkReceivers = np.tile(np.arange(n), len(senders))
+        isOther = linkSenders != linkReceivers
+        linkSenders, linkReceivers = linkSenders[isOther], linkReceivers[isOther]
+        self.statistics["sent"] += len(linkSenders)
+
+        if self.maxRange is not None:
+            dist = np.linalg.norm(self.swarm.positions[linkReceivers] - self.swarm.positions[linkSenders], axis=1)
+            inRange = dist <= self.maxRange
+            self.statistics["outOfRange"] += int(np.count_nonzero(~inRange))
+            linkSenders, linkReceivers = linkSenders[inRange], linkReceivers[inRange]
+
+        if self.lossModel is not None:
+            lost = self.lossModel.lose(self.rng, linkSenders, linkReceivers)
+            self.statistics["lost"] += int(np.count_nonzero(lost))
+            linkSenders, linkReceivers = linkSenders[~lost], linkReceivers[~lost]
+
+        latency = np.zeros(len(linkSenders)) if self.latencyModel is None else self.latencyModel.sample(self.rng, len(linkSenders))
+        self.pendingTimes = np.concatenate((self.pendingTimes, time + latency))
+        self.pendingSentTimes = np.concatenate((self.pendingSentTimes, np.full(len(linkSenders), time)))
+        self.pendingSenders = np.concatenate((self.pendingSenders, linkSenders))
+        self.pendingReceivers = np.concatenate((self.pendingReceivers, linkReceivers))
+        self.pendingPositions = np.concatenate((self.pendingPositions, self.swarm.lastSentPositions[linkSenders]))
+
+
+    def deliver(self, time):
+        """Delivers all packets that have arrived by the supplied time. A packet that was overtaken by a newer one from the same sender is discarded.
+            Returns the receivers and the positions they received."""
+        nothing = np.zeros(0, dtype=int), np.zeros((0, 3))
+        if len(self.pendingTimes) == 0:
+            return nothing
+        due = self.pendingTimes <= time
+        if not np.any(due):
+            return nothing
+        sentTimes = self.pendingSentTimes[due]
+        senders = self.pendingSenders[due]
+        receivers = self.pendingReceivers[due]
+        positions = self.pendingPositions[due]
+        self.pendingTimes = self.pendingTimes[~due]
+        self.pendingSentTimes = self.pendingSentTimes[~due]
+        self.pendingSenders = self.pendingSenders[~due]
+        self.pendingReceivers = self.pendingReceivers[~due]
+        self.pendingPositions = self.pendingPositions[~due]
+
+        isNewer = sentTimes > self.receivedTimes[receivers, senders]
+        # sorted by the time they were sent, so if a link delivers several packets at once the newest one is written last
+        order = np.argsort(sentTimes[isNewer], kind="stable")
+        receivers, senders = receivers[isNewer][order], senders[isNewer][order]
+        self.receivedPositions[receivers, senders] = positions[isNewer][order]
+        self.receivedTimes[receivers, senders] = sentTimes[isNewer][order]
+        self.statistics["delivered"] += len(receivers)
+        return receivers, self.receivedPositions[receivers, senders]
+
+
+    def receivedPairs(self):
+        """Returns the receivers, the senders and the positions of all links over which a position has been received."""
+        n = self.swarm.count
+        self._ensureCapacity(n)
+        receivers, senders = np.nonzero(self.receivedTimes[:n, :n] > -np.inf)
+        return receivers, senders, self.receivedPositions[receivers, senders]
+
+
+    def getReceivedPositions(self, index) -> np.ndarray:
+        """Returns the positions the drone with the supplied index received from the other drones."""
+        n = self.swarm.count
+        self._ensureCapacity(n)
+        return self.receivedPositions[index, :n][self.receivedTimes[index, :n] > -np.inf]
+
+
+    def _ensureCapacity(self, n):
+        if n > self.capacity:
+            self._allocate(max(n, 2 * self.capacity))
+
+
+    def _allocate(self, capacity):
+        """Reallocates the views with a bigger capacity, keeping the received positions."""
+        receivedPositions = np.zeros((capacity, capacity, 3))
+        receivedTimes = np.full((capacity, capacity), -np.inf)  # -inf means nothing has been received over this link
+        receivedPositions[:self.capacity, :self.capacity] = self.receivedPositions
+        receivedTimes[:self.capacity, :self.capacity] = self.receivedTimes
+        self.receivedPositions = receivedPositions
+        self.receivedTimes = receivedTimes
+        self.capacity = capacity
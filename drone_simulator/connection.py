@@ -0,0 +1,100 @@
+import time
+import threading
+
+
+class SwarmConnector:
+    """Connects and disconnects the real drones of the swarm concurrently. Each drone opens its link, resets its position estimator
+        and waits for the estimator to converge in a thread of its own, so the render loop keeps running and the whole swarm takes
+        about as long as the slowest drone. The progress of each drone can be read from its connectionState, a drone only starts
+        sending setpoints once it is connected. Drones that are not connected before the timeout are given up on.
+        The drones are disconnected by the radio workers of the SetpointStreamer, so the stop setpoint is sent after the last setpoint.
+        The first drone warms the shared TOC cache, the others open their link once it has its TOCs and read them from the cache,
+        so a swarm of drones with the same firmware downloads them only once."""
+
+    TIMEOUT = 30  # seconds for a drone to connect and for its estimator to converge
+    WARMUPTIMEOUT = 5  # seconds the other drones wait for the first one to fetch its TOCs before they fetch their own
+    FINALSTATES = ("disconnected", "connected", "failed", "timed out")
+
+    def __init__(self, drones, streamer, timeout=TIMEOUT):
+        self.drones = [drone for drone in drones if drone.canConnect]
+        self.streamer = streamer
+        self.timeout = timeout
+        self.startTime = None
+        self.deadline = None  # in time.monotonic()
+        self.isCancelled = False  # set when disconnecting, drones that are still connecting close their link once they are done
+        self.threads = []
+        self.tocCacheWarmed = threading.Event()
+
+
+    def connectAll(self):
+        """Starts connecting all drones which have a uri, returns right away."""
+        self.isCancelled = False
+        self.startTime = time.monotonic()
+        self.deadline = self.startTime + self.timeout
+        self.threads = []
+        self.tocCacheWarmed.clear()
+        for drone in self.drones:
+            drone.connectionState = "waiting"
+            reconnectThread = drone.linkHealth.attemptThread  # the LinkHealthMonitor was still reconnecting the drone when it was disconnected
+            thread = threading.Thread(target=self._connect, args=(drone, drone is self.drones[0], reconnectThread), name=f"Connect {drone.uri}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+
+    def _connect(self, drone, warmsTocCache, reconnectThread=None):
+        """Connects a single drone, this runs in the thread of the drone. If the drone was still being reconnected, the attempt
+            closes its link once it is done, which is waited for."""
+        if reconnectThread is not None:
+            reconnectThread.join(max(self.deadline - time.monotonic(), 0))
+        try:
+            if warmsTocCache:
+                try:
+                    drone.connect(self.deadline, writeTocCache=True, onLinkOpened=self.tocCacheWarmed.set)
+                finally:
+                    self.tocCacheWarmed.set()  # don't keep the others waiting if the first drone failed
+            else:
+                self.tocCacheWarmed.wait(self.WARMUPTIMEOUT)
+                drone.connect(self.deadline)
+        except TimeoutError:
+            drone.connectionState = "timed out"
+            print(drone.uri, "timed out")
+        except Exception as e:
+            drone.connectionState = "failed"
+            print(drone.uri, "failed to connect:", e)
+
+        if drone.connectionState != "connected" or self.isCancelled:
+            drone.isConnected = False
+            if drone.scf is not None:
+                drone.scf.close_link()
+            if self.isCancelled:
+                drone.connectionState = "disconnected"
+
+
+    def disconnectAll(self):
+        """Stops sending setpoints to all drones right away and disconnects them in the background on the worker of their radio."""
+        self.isCancelled = True
+        for drone in self.drones:
+            if drone.isConnected:
+                drone.isConnected = False
+                self.streamer.submit(drone, drone.disconnect)
+
+
+    def isDone(self) -> bool:
+        """Returns true once every drone is either connected or has been given up on."""
+        return all(not thread.is_alive() for thread in self.threads)
+
+
+    def getState(self, drone) -> str:
+        """Returns the connection state of the drone, a drone which is still busy after the timeout counts as timed out."""
+        if drone.connectionState not in self.FINALSTATES and self.deadline is not None and time.monotonic() > self.deadline:
+            return "timed out"
+        return drone.connectionState
+
+
+    def getProgress(self) -> str:
+        """Returns a line for the whole swarm followed by one line per drone, e.g. for an onscreen text."""
+        connected = sum(drone.connectionState == "connected" for drone in self.drones)
+        elapsed = 0 if self.startTime is None else time.monotonic() - self.startTime
+        lines = [f"{connected}/{len(self.drones)} drones connected, {elapsed:.0f}/{self.timeout} s"]
+        lines += [f"{drone.uri}: {self.getState(drone)}" for drone in self.drones]
+        return "\n".join(lines)
@@ -0,0 +1,106 @@
+import numpy as np
+
+from direct.showbase import DirectObject
+from panda3d.core import Geom
+from panda3d.core import GeomLines
+from panda3d.core import GeomNode
+from panda3d.core import GeomVertexData
+from panda3d.core import GeomVertexFormat
+
+
+class SwarmDebugLines(DirectObject.DirectObject):
+    """Draws the debug lines of all drones, one geometry per line category for the whole swarm.
+        The vertices are preallocated and rewritten in place every frame, instead of building new LineSegs for every drone.
+        The categories can be toggled with the keys 1 to 4."""
+
+    # name: color, enabled by default, toggle key
+    CATEGORIES = {
+        "target": ((1.0, 0.0, 0.0, 1.0), True, "1"),
+        "velocity": ((0.0, 0.0, 1.0, 1.0), False, "2"),
+        "force": ((0.0, 1.0, 0.0, 1.0), True, "3"),
+        "setpoint": ((1.0, 1.0, 1.0, 1.0), False, "4"),
+    }
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.swarm = manager.swarm
+        self.capacity = 0  # the amount of lines each geometry has room for
+        self.needsUpdate = True  # the lines only change while drones are active, or when a category is shown
+        self.activeCount = 0
+
+        self.vertexData = {}
+        self.nodePaths = {}
+        self.enabled = {}
+        for name, (color, enabled, key) in self.CATEGORIES.items():
+            self.vertexData[name] = GeomVertexData(name, GeomVertexFormat.getV3(), Geom.UHDynamic)
+            node = GeomNode(name + "Lines")
+            node.addGeom(Geom(self.vertexData[name]))
+            self.nodePaths[name] = manager.base.render.attachNewNode(node)
+            self.nodePaths[name].setColor(*color)
+            self.nodePaths[name].setLightOff()
+            self.setEnabled(name, enabled)
+            self.accept(key, self.toggle, [name])
+
+
+    def setEnabled(self, name, enabled):
+        """Shows or hides all lines of a category."""
+        self.enabled[name] = enabled
+        self.needsUpdate = True
+        if enabled:
+            self.nodePaths[name].show()
+        else:
+            self.nodePaths[name].hide()
+
+
+    def toggle(self, name):
+        self.setEnabled(name, not self.enabled[name])
+
+
+    def update(self):
+        """Rewrites the vertices of all enabled categories with the current state of the swarm.
+            Once all drones have settled, the lines are rewritten one last time and then left alone."""
+        n = self.swarm.count
+        if n > self.capacity:
+            self._allocate(max(n, 2 * self.capacity))
+            self.needsUpdate = True
+        activeCount = np.count_nonzero(self.swarm.active[:n])
+        if activeCount == 0 and self.activeCount == 0 and not self.needsUpdate:
+            return
+        self.activeCount = activeCount
+        self.needsUpdate = False
+
+        positions = self.swarm.positions[:n]
+        for name in self.CATEGORIES:
+            if not self.enabled[name]:
+                continue
+            if name == "target":
+                ends = self.swarm.targets[:n]
+            elif name == "velocity":
+                ends = positions + self.swarm.velocities[:n]
+            elif name == "force":
+                ends = positions + self.swarm.forces[:n] * 0.2
+            else:
+                ends = self.swarm.setpoints[:n]
+            self._writeLines(name, positions, ends)
+
+
+    def _writeLines(self, name, starts, ends):
+        """Writes the lines from starts to ends directly into the vertex memory, unused lines are collapsed to a point."""
+        vertices = np.frombuffer(memoryview(self.vertexData[name].modifyArray(0)).cast("B"), dtype=np.float32).reshape(-1, 2, 3)
+        n = len(starts)
+        vertices[:n, 0] = starts
+        vertices[:n, 1] = ends
+        vertices[n:] = 0
+
+
+    def _allocate(self, capacity):
+        """Resizes the vertex data of all categories to hold capacity lines and rebuilds their primitives."""
+        self.capacity = capacity
+        for name, vertexData in self.vertexData.items():
+            vertexData.setNumRows(2 * capacity)
+            lines = GeomLines(Geom.UHStatic)
+            lines.addNextVertices(2 * capacity)
+            lines.closePrimitive()
+            geom = self.nodePaths[name].node().modifyGeom(0)
+            geom.clearPrimitives()
+            geom.addPrimitive(lines)
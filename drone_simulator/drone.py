@@ -1,18 +1,15 @@
 import time
 import math
 import random
+import threading
+
+import numpy as np
 
-from cflib.crazyflie import Crazyflie
-from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
-from cflib.crazyflie.syncLogger import SyncLogger
 
 from panda3d.core import Vec3
-from panda3d.core import BitMask32
-from panda3d.core import LineSegs
-from panda3d.bullet import BulletSphereShape
-from panda3d.bullet import BulletRigidBodyNode
-from panda3d.bullet import BulletGhostNode
+
+from toc_cache import createCrazyflie
 
 
 class Drone:
@@ -33,128 +30,200 @@ class Drone:
     AVOIDANCEFORCE = 10
     FORCEFALLOFFDISTANCE = .5
 
-    def __init__(self, manager, position: Vec3, uri="-1", printDebugInfo=False):
+    def __init__(self, manager, position: Vec3, uri="-1", printDebugInfo=False, droneId=None):
 
         self.base = manager.base
         self.manager = manager
 
-        # The position of the real drone this virtual drone is connected to.
-        # If a connection is active, this value is updated each frame.
-        self.realDronePosition = Vec3(0, 0, 0)
+        # the telemetry of the real drone this virtual drone is connected to is stored in the row telemetryRow of the TelemetryStore of the manager
+        self.telemetryRow = None
+        self.telemetryPeriod = 0  # seconds between two positions logged by the real drone
+        self.linkHealth = None  # see LinkHealthMonitor, only drones with a uri have one
 
         self.canConnect = False  # true if the virtual drone has a uri to connect to a real drone
         self.isConnected = False  # true if the connection to a real drone is currently active
+        self.connectionState = "disconnected"  # the progress of connecting, see SwarmConnector
+        self.scf = None
+        self.lastSendTime = 0  # the wall clock time the last setpoint was sent, written by the SetpointStreamer
+        self.sentSetpoints = 0  # setpoints sent and suppressed since the SetpointStreamer was started
+        self.suppressedSetpoints = 0
         self.uri = uri
         if self.uri != "-1":
             self.canConnect = True
-        self.id = int(uri[-1])
+
+        # positions, velocities, targets, setpoints, sent positions and random vectors are stored in the arrays of the swarm engine
+        self.swarm = manager.swarm
+        self.index = self.swarm.addDrone(self)
+        # the id tells the drones apart, by default it is the order in which the drones were spawned. The timeslot is assigned by the tdma schedule
+        self.id = self.index if droneId is None else droneId
+        self.swarm.ids[self.index] = self.id
 
         self.randVec = Vec3(random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1))
 
-        # add the rigidbody to the drone, which has a mass and linear damping
-        self.rigidBody = BulletRigidBodyNode("RigidSphere")  # derived from PandaNode
-        self.rigidBody.setMass(self.RIGIDBODYMASS)  # body is now dynamic
-        self.rigidBody.addShape(BulletSphereShape(self.RIGIDBODYRADIUS))
-        self.rigidBody.setLinearSleepThreshold(0)
-        self.rigidBody.setFriction(0)
-        self.rigidBody.setLinearDamping(self.LINEARDAMPING)
-        self.rigidBodyNP = self.base.render.attachNewNode(self.rigidBody)
-        self.rigidBodyNP.setPos(position)
-        # self.rigidBodyNP.setCollideMask(BitMask32.bit(1))
-        self.base.world.attach(self.rigidBody)
+        self.isHeadless = manager.headless  # if true, the drone has no model
+        self.printDebugInfo = printDebugInfo
+        # usually the models of all drones are drawn by the instanced swarm model, otherwise each drone needs its own model
+        self.hasOwnModel = not self.isHeadless and manager.droneModels is None
+
+        # add the body to the drone, which has a mass and linear damping. Depending on the physics backend this is a Bullet rigid body or a point mass
+        self.body = self.base.physics.createBody(self.base, self, position)
 
         # add a 3d model to the drone to be able to see it in the 3d scene
-        model = self.base.loader.loadModel(self.base.modelDir + "/drones/drone1.egg")
-        model.setScale(0.2)
-        model.reparentTo(self.rigidBodyNP)
+        if self.hasOwnModel:
+            model = self.base.loader.loadModel(self.base.modelDir + "/drones/drone1.egg")
+            model.setScale(0.2)
+            model.reparentTo(self.body.nodePath)
 
         self.target = position  # the long term target that the virtual drones tries to reach
-        self.setpoint = position  # the immediate target (setpoint) that the real drone tries to reach, usually updated each frame
+        self.setpoint = position  # the immediate target (setpoint) that the real drone tries to reach, updated whenever the SetpointStreamer sends it
         self.waitingPosition = Vec3(position[0], position[1], 0.7)
         self.lastSentPosition = self.waitingPosition  # the position that this drone last sent around
 
-        self.printDebugInfo = printDebugInfo
-        if self.printDebugInfo:  # put a second drone model on top of drone that outputs debug stuff
+        if self.printDebugInfo and not self.isHeadless:  # put a second drone model on top of drone that outputs debug stuff
             model = self.base.loader.loadModel(self.base.modelDir + "/drones/drone1.egg")
             model.setScale(0.4)
             model.setPos(0, 0, .2)
-            model.reparentTo(self.rigidBodyNP)
+            model.reparentTo(self.body.nodePath)
 
-        # initialize line renderers
-        self.targetLineNP = self.base.render.attachNewNode(LineSegs().create())
-        self.velocityLineNP = self.base.render.attachNewNode(LineSegs().create())
-        self.forceLineNP = self.base.render.attachNewNode(LineSegs().create())
-        self.actualDroneLineNP = self.base.render.attachNewNode(LineSegs().create())
-        self.setpointNP = self.base.render.attachNewNode(LineSegs().create())
 
 
-    def connect(self):
-        """Connects the virtual drone to a real one with the uri supplied at initialization."""
+    def connect(self, deadline=math.inf, writeTocCache=False, onLinkOpened=None, resetEstimator=True):
+        """Connects the virtual drone to a real one with the uri supplied at initialization. Blocks until the position estimator has converged,
+            so the SwarmConnector runs it in a thread of its own. Raises a TimeoutError if the drone isn't connected by the deadline (in time.monotonic()).
+            The TOCs are read from the shared cache and only saved to it if writeTocCache is set, onLinkOpened is called once they are known.
+            A drone that reconnects after its link was lost keeps its position estimate, so its estimator isn't reset."""
         if not self.canConnect:
             return
         print(self.uri, "connecting")
-        self.isConnected = True
-        self.scf = SyncCrazyflie(self.uri, cf=Crazyflie(rw_cache='./cache'))
-        self.scf.open_link()
-        self._reset_estimator()
+        self.connectionState = "connecting"
+        self.scf = SyncCrazyflie(self.uri, cf=createCrazyflie(writeTocCache))
+        self._open_link(deadline)
+        if onLinkOpened is not None:
+            onLinkOpened()
+        self.manager.linkHealth.watch(self)
         self.start_position_printing()
+        if resetEstimator:
+            self._reset_estimator(deadline)
 
         # MOVE THIS BACK TO SENDPOSITIONS() IF STUFF BREAKS
-        self.scf.cf.param.set_value('flightmode.posSet', '1')
+        self.manager.streamer.submit(self, self.scf.cf.param.set_value, 'flightmode.posSet', '1')
 
-
-    def sendPosition(self):
-        """Sends the position of the virtual drone to the real one."""
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{self.uri} was not connected within the timeout")
+        # only now the render loop starts sending setpoints
+        self.isConnected = True
+        self.connectionState = "connected"
+        print(self.uri, "connected")
+
+
+    def _open_link(self, deadline=math.inf):
+        """Opens the link to the real drone, raises a TimeoutError if it isn't open by the deadline. cflib waits for the drone
+            without a timeout, so the link is opened in a thread of its own, which is released by failing the connection."""
+        errors = []
+
+        def openLink():
+            try:
+                self.scf.open_link()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=openLink, name=f"OpenLink {self.uri}", daemon=True)
+        thread.start()
+        thread.join(None if deadline == math.inf else max(deadline - time.monotonic(), 0))
+        if thread.is_alive():
+            self.scf.cf.connection_failed.call(self.uri, "timed out")  # wakes up open_link(), which closes the link and raises in the thread
+            thread.join(1)
+            raise TimeoutError(f"{self.uri} did not open its link within the timeout")
+        if errors:
+            raise errors[0]
+
+
+    def sendPosition(self, position):
+        """Sends the supplied position of the virtual drone to the real one as its setpoint. Called by the SetpointStreamer from its own thread."""
         cf = self.scf.cf
-        self.setpoint = self.getPos()
+        self.lastSendTime = time.monotonic()
+        self.swarm.setpoints[self.index] = position
         # send the setpoint
-        cf.commander.send_position_setpoint(self.setpoint[0], self.setpoint[1], self.setpoint[2], 0)
+        cf.commander.send_position_setpoint(position[0], position[1], position[2], 0)
 
 
     def disconnect(self):
         """Disconnects the real drone."""
         print(self.uri, "disconnecting")
         self.isConnected = False
+        self.connectionState = "disconnected"
         cf = self.scf.cf
         cf.commander.send_stop_setpoint()
         time.sleep(0.1)
         self.scf.close_link()
 
 
-    def update(self):
-        """Update the virtual drone."""
-        # self.updateSentPositionBypass(0)
+    @property
+    def target(self) -> Vec3:
+        """The long term target that the virtual drones tries to reach."""
+        return Vec3(*self.swarm.targets[self.index])
+
+    @target.setter
+    def target(self, target: Vec3):
+        self.swarm.targets[self.index] = target
+        self.swarm.wake(self.index)
+
+
+    @property
+    def setpoint(self) -> Vec3:
+        """The immediate target (setpoint) that the real drone tries to reach, updated whenever the SetpointStreamer sends it."""
+        return Vec3(*self.swarm.setpoints[self.index])
+
+    @setpoint.setter
+    def setpoint(self, setpoint: Vec3):
+        self.swarm.setpoints[self.index] = setpoint
 
-        self._updateTargetForce()
-        self._updateAvoidanceForce()
-        self._clampForce()
 
-        if self.isConnected:
-            self.sendPosition()
+    @property
+    def lastSentPosition(self) -> Vec3:
+        """The position that this drone last sent around."""
+        return Vec3(*self.swarm.lastSentPositions[self.index])
 
-        # draw various lines to get a better idea of whats happening
-        self._drawTargetLine()
-        # self._drawVelocityLine()
-        self._drawForceLine()
-        # self._drawSetpointLine()
+    @lastSentPosition.setter
+    def lastSentPosition(self, position: Vec3):
+        self.swarm.lastSentPositions[self.index] = position
+
+
+    @property
+    def randVec(self) -> Vec3:
+        """The random vector that is mixed into the avoidance direction."""
+        return Vec3(*self.swarm.randVecs[self.index])
+
+    @randVec.setter
+    def randVec(self, randVec: Vec3):
+        self.swarm.randVecs[self.index] = randVec
+
+
+    def updateForces(self):
+        """Computes and applies the forces of this drone only. The swarm engine does the same for all drones at once."""
+        profiler = self.base.profiler
+        with profiler.measure("UpdateForces/Target"):
+            self._updateTargetForce()
+        with profiler.measure("UpdateForces/Avoidance"):
+            self._updateAvoidanceForce()
+        with profiler.measure("UpdateForces/Clamp"):
+            self._clampForce()
+        self.swarm.forces[self.index] = self.body.getTotalForce()  # keep the force array up to date for the debug lines
+
+
+    def update(self):
+        """Update the virtual drone. The forces are updated separately on every simulation step, either by updateForces() or by the swarm engine.
+            The setpoints of the real drone are sent by the SetpointStreamer at a fixed rate."""
+        # self.updateSentPositionBypass(0)
 
         self._printDebugInfo()
     
-    def updateSentPosition(self, timeslot):
-        transmissionProbability = 1
-        if self.id == timeslot:
-            if random.uniform(0, 1) < transmissionProbability:
-                # print(f"drone {self.id} updated position")
-                self.lastSentPosition = self.getPos()
-            else:
-                pass
-                # print(f"drone {self.id} failed!")
-
     def updateSentPositionBypass(self, timeslot):
         self.lastSentPosition = self.getPos()
 
     def getPos(self) -> Vec3:
-        return self.rigidBodyNP.getPos()
+        """Returns the position from the snapshot the drone manager takes on every step."""
+        return Vec3(*self.swarm.positions[self.index])
 
     
     def getLastSentPos(self) -> Vec3:
@@ -163,30 +232,23 @@ class Drone:
 
     def _updateTargetForce(self):
         """Applies a force to the virtual drone which moves it closer to its target."""
-        dist = (self.target - self.getPos())
-        if(dist.length() > self.FORCEFALLOFFDISTANCE):
-            force = dist.normalized()
+        dist = self.swarm.targets[self.index] - self.swarm.positions[self.index]
+        length = np.linalg.norm(dist)
+        if(length > self.FORCEFALLOFFDISTANCE):
+            force = dist / length
         else:
             force = (dist / self.FORCEFALLOFFDISTANCE)
-        self.addForce(force * self.TARGETFORCE)
+        self.addForce(Vec3(*(force * self.TARGETFORCE)))
 
 
     def _updateAvoidanceForce(self):
         """Applies a force the the virtual drone which makes it avoid other drones."""
         # get all drones within the sensors reach and put them in a list
-        nearbyDrones = []
-        for drone in self.manager.drones:
-            dist = (drone.getLastSentPos() - self.getPos()).length()
-            if drone.id == self.id:  # prevent drone from detecting itself
-                continue
-            if dist < self.SENSORRANGE: 
-                nearbyDrones.append(drone)
+        distVecs = self.manager.getKnownDronePositions(self) - self.swarm.positions[self.index]
+        nearbyDrones = [Vec3(*distVec) for distVec in distVecs[np.linalg.norm(distVecs, axis=1) < self.SENSORRANGE]]
 
         # calculate and apply forces
-        for nearbyDrone in nearbyDrones:
-            distVec = nearbyDrone.getLastSentPos() - self.getPos()
-            if distVec.length() < 0.2:
-                print("BONK")
+        for distVec in nearbyDrones:
             distMult = self.SENSORRANGE - distVec.length()
             avoidanceDirection = self.randVec.normalized() * 2 - distVec.normalized() * 10
             avoidanceDirection.normalize()
@@ -195,10 +257,10 @@ class Drone:
 
     def _clampForce(self):
         """Clamps the total force acting in the drone."""
-        totalForce = self.rigidBody.getTotalForce()
+        totalForce = self.body.getTotalForce()
         if totalForce.length() > 2:
-            self.rigidBody.clearForces()
-            self.rigidBody.applyCentralForce(totalForce.normalized())
+            self.body.clearForces()
+            self.body.applyCentralForce(totalForce.normalized())
 
 
     def targetVector(self) -> Vec3:
@@ -226,130 +288,71 @@ class Drone:
 
 
     def addForce(self, force: Vec3):
-        self.rigidBody.applyCentralForce(force)
+        self.body.applyCentralForce(force)
 
 
     def setPos(self, position: Vec3):
-        self.rigidBodyNP.setPos(position)
+        self.body.setPos(position)
+        self.swarm.positions[self.index] = position  # keep the snapshot up to date until the next step
+        self.swarm.wake(self.index)
 
 
     def getVel(self) -> Vec3:
-        return self.rigidBody.getLinearVelocity()
+        """Returns the velocity from the snapshot the drone manager takes on every step."""
+        return Vec3(*self.swarm.velocities[self.index])
 
 
     def setVel(self, velocity: Vec3):
-        return self.rigidBody.setLinearVelocity(velocity)
-
-
-    def _drawTargetLine(self):
-        self.targetLineNP.removeNode()
-        ls = LineSegs()
-        # ls.setThickness(1)
-        ls.setColor(1.0, 0.0, 0.0, 1.0)
-        ls.moveTo(self.getPos())
-        ls.drawTo(self.target)
-        node = ls.create()
-        self.targetLineNP = self.base.render.attachNewNode(node)
-
-
-    def _drawVelocityLine(self):
-        self.velocityLineNP.removeNode()
-        ls = LineSegs()
-        # ls.setThickness(1)
-        ls.setColor(0.0, 0.0, 1.0, 1.0)
-        ls.moveTo(self.getPos())
-        ls.drawTo(self.getPos() + self.getVel())
-        node = ls.create()
-        self.velocityLineNP = self.base.render.attachNewNode(node)
-
-
-    def _drawForceLine(self):
-        self.forceLineNP.removeNode()
-        ls = LineSegs()
-        # ls.setThickness(1)
-        ls.setColor(0.0, 1.0, 0.0, 1.0)
-        ls.moveTo(self.getPos())
-        ls.drawTo(self.getPos() + self.rigidBody.getTotalForce() * 0.2)
-        node = ls.create()
-        self.forceLineNP = self.base.render.attachNewNode(node)
-
-
-    def _drawSetpointLine(self):
-        self.setpointNP.removeNode()
-        ls = LineSegs()
-        # ls.setThickness(1)
-        ls.setColor(1.0, 1.0, 1.0, 1.0)
-        ls.moveTo(self.getPos())
-        ls.drawTo(self.setpoint)
-        node = ls.create()
-        self.setpointNP = self.base.render.attachNewNode(node)
-
-
-    def _wait_for_position_estimator(self):
-        """Waits until the position estimator reports a consistent location after resetting."""
-        print('Waiting for estimator to find position...')
-
-        log_config = LogConfig(name='Kalman Variance', period_in_ms=500)
-        log_config.add_variable('kalman.varPX', 'float')
-        log_config.add_variable('kalman.varPY', 'float')
-        log_config.add_variable('kalman.varPZ', 'float')
-
-        var_y_history = [1000] * 10
-        var_x_history = [1000] * 10
-        var_z_history = [1000] * 10
-
+        self.body.setVel(velocity)
+        self.swarm.velocities[self.index] = velocity
+        self.swarm.wake(self.index)
+
+
+    def _wait_for_position_estimator(self, deadline=math.inf):
+        """Waits until the position estimator reports a consistent location after resetting, raises a TimeoutError after the deadline.
+            The variances of the estimate are logged by the slow log block into the telemetry store."""
+        print(self.uri, 'waiting for estimator to find position...')
+        self.connectionState = "waiting for estimator"
+        variances = self.manager.telemetry.variances
+        start = time.monotonic()
+        sampleCount = 10
         threshold = 0.001
 
-        with SyncLogger(self.scf, log_config) as logger:
-            for log_entry in logger:
-                data = log_entry[1]
-
-                var_x_history.append(data['kalman.varPX'])
-                var_x_history.pop(0)
-                var_y_history.append(data['kalman.varPY'])
-                var_y_history.pop(0)
-                var_z_history.append(data['kalman.varPZ'])
-                var_z_history.pop(0)
+        while True:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"the position estimator of {self.uri} did not converge within the timeout")
+            # the estimate is consistent if the variances of the last samples since the reset hardly change
+            _, history = variances.window(self.telemetryRow, start)
+            if len(history) >= sampleCount and np.all(np.ptp(history[-sampleCount:], axis=0) < threshold):
+                break
+            time.sleep(0.1)
 
-                min_x = min(var_x_history)
-                max_x = max(var_x_history)
-                min_y = min(var_y_history)
-                max_y = max(var_y_history)
-                min_z = min(var_z_history)
-                max_z = max(var_z_history)
 
-                if (max_x - min_x) < threshold and (
-                        max_y - min_y) < threshold and (
-                        max_z - min_z) < threshold:
-                    break
-
-
-    def _reset_estimator(self):
+    def _reset_estimator(self, deadline=math.inf):
         """Resets the position estimator, this should be run before flying the drones or they might report a wrong position."""
+        self.connectionState = "resetting estimator"
         cf = self.scf.cf
-        cf.param.set_value('kalman.resetEstimation', '1')
+        self.manager.streamer.submit(self, cf.param.set_value, 'kalman.resetEstimation', '1')
         time.sleep(0.1)
-        cf.param.set_value('kalman.resetEstimation', '0')
+        self.manager.streamer.submit(self, cf.param.set_value, 'kalman.resetEstimation', '0')
+
+        self._wait_for_position_estimator(deadline)
+
 
-        self._wait_for_position_estimator()
+    @property
+    def realDronePosition(self) -> Vec3:
+        """The newest position received from the real drone this virtual drone is connected to."""
+        latest = None if self.telemetryRow is None else self.manager.telemetry.positions.latest(self.telemetryRow)
+        return Vec3(0, 0, 0) if latest is None else Vec3(*latest[1])
 
 
     def position_callback(self, timestamp, data, logconf):
-        """Updates the variable holding the position of the actual drone. It is not called in the update method, but by the drone itself (I think)."""
-        x = data['kalman.stateX']
-        y = data['kalman.stateY']
-        z = data['kalman.stateZ']
-        self.realDronePosition = Vec3(x, y, z)
-        # print('pos: ({}, {}, {})'.format(x, y, z))
+        """Writes the telemetry of the actual drone into the telemetry store. It is not called in the update method, but by the drone itself (I think)."""
+        self.manager.telemetry.writeLog(self.telemetryRow, time.monotonic(), data)
 
 
     def start_position_printing(self):
-        """Activate logging of the position of the real drone."""
-        log_conf = LogConfig(name='Position', period_in_ms=50)
-        log_conf.add_variable('kalman.stateX', 'float')
-        log_conf.add_variable('kalman.stateY', 'float')
-        log_conf.add_variable('kalman.stateZ', 'float')
-
-        self.scf.cf.log.add_config(log_conf)
-        log_conf.data_received_cb.add_callback(self.position_callback)
-        log_conf.start()
+        """Activate logging of the telemetry of the real drone, the log blocks are set up by the TelemetrySubscriptions of the manager."""
+        period = self.manager.telemetrySubscriptions.subscribe(self, self.position_callback)
+        self.telemetryPeriod = period / 1000
+        print(self.uri, f"logging the position every {period} ms")
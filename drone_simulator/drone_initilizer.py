@@ -1,13 +1,14 @@
 import time
 
 import cflib.crtp
-from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from cflib.crazyflie.syncLogger import SyncLogger
 
 from panda3d.core import Vec3
 
+from toc_cache import createCrazyflie
+
 
 class SimpleDrone():
 
@@ -92,7 +93,7 @@ class SimpleDrone():
 
     def initDrone(self, posAddressList):
         print("Resetting and locating ", self.address)
-        scf = SyncCrazyflie(self.address, cf=Crazyflie(rw_cache='./cache'))
+        scf = SyncCrazyflie(self.address, cf=createCrazyflie(writable=True))
         scf.open_link()
         self.reset_estimator(scf)
         self.start_position_printing(scf)
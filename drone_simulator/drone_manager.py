@@ -4,12 +4,26 @@ import math
 from scipy.spatial.transform import Rotation as R
 
 from drone import Drone
+from swarm import SwarmForceEngine
+from spatial_hash import SpatialHash
+from tdma import TdmaSchedule
+from sharding import SwarmShards
+from proximity import ProximityMonitor
+from connection import SwarmConnector
+from health import LinkHealthMonitor
+from streaming import SetpointStreamer
+from telemetry import TelemetryStore, TelemetrySubscriptions
+from loopback import registerLoopbackDriver
+from debug_lines import SwarmDebugLines
+from instanced_models import InstancedDroneModels
 from formations.formation_ui_element import loadFormationSelectionFrame
 
 import cflib.crtp
 
 from panda3d.core import Vec3
+from panda3d.core import TextNode
 from direct.showbase import DirectObject
+from direct.gui.OnscreenText import OnscreenText
 from direct.gui.DirectGui import DirectButton
 from direct.gui.DirectGui import DirectEntry
 from direct.gui.DirectGui import DirectFrame
@@ -17,23 +31,29 @@ from direct.gui.DirectGui import DirectFrame
 
 class DroneManager(DirectObject.DirectObject):
 
-    def __init__(self, base, droneList, delay):
+    def __init__(self, base, droneList, delay, headless=False, guardTimeMilli=0, workers=0, setpointRate=SetpointStreamer.RATE,
+                 setpointThreshold=SetpointStreamer.THRESHOLD):
         self.base = base
+        self.setpointRate = setpointRate  # setpoints per second sent to each connected drone
+        self.setpointThreshold = setpointThreshold  # meters a setpoint has to move before it is sent again, otherwise only keepalives are sent
+        self.headless = headless  # if true, no models, lines or UI elements are created
+        self.workers = workers  # if not 0, the drones are simulated in this many worker processes, see SwarmShards
         # the actual dimensions of the bcs drone lab in meters
         # self.roomSize = Vec3(3.40, 4.56, 2.56)
         # confined dimensions because the room and drone coordinates dont match up yet.
         # Also, flying near the windows/close to walls/too high often makes the llighthouse positioning system loose track
         self.roomSize = Vec3(1.5, 2.5, 1.7)
         self.initDrones(droneList)
-        self.initUI()
+        # decides when each drone sends its position, by default every drone has its own timeslot of length delay
+        self.tdma = TdmaSchedule(self.swarm, slotLengthMilli=delay, guardTimeMilli=guardTimeMilli)
+        self.channel = None  # the simulated radio channel, None means every drone receives every sent position instantly
+        self.connectionText = None
+        if not self.headless:
+            self.initUI()
 
         self.currentFormation = 0
         self.isRotating = False
 
-        self.currentTimeslot = 0
-
-        self.timeslotLengthMilli = delay
-
 
     def initDrones(self, droneList):
         """Initializes the drones defined in droneList."""
@@ -41,6 +61,13 @@ class DroneManager(DirectObject.DirectObject):
         self.isConnected = False
         self.drones = []  # this is the list of all drones
         self.currentDronePos = []  # this is the list of the most recent position that was sent by each drone
+        self.neighborIndex = SpatialHash(Drone.SENSORRANGE)  # a grid over the last sent positions, used to find nearby drones
+        self.swarm = SwarmForceEngine(Drone, self.neighborIndex, self.base.physics, self.base.profiler)  # holds the state of all drones in numpy arrays and computes their forces
+        self.useSwarmEngine = True  # if false, each drone computes its own forces, which is a lot slower for big swarms
+        # all drone models are drawn as instances of a single model, unless the graphics card doesn't support it
+        self.droneModels = None
+        if not self.headless and InstancedDroneModels.isSupported(self.base):
+            self.droneModels = InstancedDroneModels(self.base, self.swarm)
 
         if droneList == []:
             print("No drones to spawn")
@@ -48,29 +75,120 @@ class DroneManager(DirectObject.DirectObject):
             for i in range(0, len(droneList)):
                 position = droneList[i][0]
                 uri = droneList[i][1]
-                self.drones.append(Drone(self, position, uri=uri))
+                droneId = droneList[i][2] if len(droneList[i]) > 2 else None  # optional, by default the drones are numbered in order
+                self.drones.append(Drone(self, position, uri=uri, droneId=droneId))
+        self.updateSnapshot(0)
+        self.updateNeighborIndex()
+        self.proximity = ProximityMonitor(self.swarm)  # counts near misses and collisions, reset whenever a recording starts
+        self.telemetry = TelemetryStore(self.drones)  # the positions, velocities, battery voltages and variances received from the real drones
+        self.streamer = SetpointStreamer(self.drones, self.setpointRate, self.setpointThreshold)  # sends the setpoints to the real drones, one thread per radio
+        self.telemetrySubscriptions = TelemetrySubscriptions(self.telemetry, self.streamer)  # sets up the log blocks within the bandwidth of each radio
+        self.connector = SwarmConnector(self.drones, self.streamer)  # connects the real drones in the background
+        self.linkHealth = LinkHealthMonitor(self.drones, self.telemetry)  # detects degraded and lost links and reconnects lost drones
+
+        # for big swarms, the drones can be partitioned across worker processes which share the swarm arrays
+        self.shards = SwarmShards(self.swarm, self.base.physics, self.workers) if self.workers > 0 else None
+
+        # the debug lines of all drones are drawn by a single object, the categories can be toggled with the keys 1 to 4
+        self.debugLines = None if self.headless else SwarmDebugLines(self)
+
+        self.base.simClock.addStepCallback(self.updateSnapshot, "UpdateSnapshot")
+        self.base.simClock.addStepCallback(self.updateProximity, "UpdateProximity")
+        self.base.simClock.addStepCallback(self.updateChannel, "UpdateChannel")
+        self.base.simClock.addStepCallback(self.updateForces, "UpdateForces")
+        self.base.simClock.addStepCallback(self.publishSetpoints, "PublishSetpoints")
+        self.base.simClock.add(self.updateTimeslotTask, "UpdateTimeslot")
+        self.base.finalExitCallbacks.append(self.shutdown)
+        self.base.taskMgr.add(self.base.profiler.wrapTask(self.updateDronesTask, "UpdateDrones"), "UpdateDrones")
+
+    def setChannel(self, channel):
+        """Sends the positions over the supplied ChannelSimulator from now on, or instantly to every drone if channel is None.
+            The received views start out with the current last sent positions."""
+        if channel is not None and self.shards is not None:
+            raise ValueError("A channel can't be simulated while the swarm is sharded")
+        self.channel = channel
+        self.tdma.channel = channel
+        self.swarm.channel = channel
+        if channel is not None:
+            channel.resetViews(self.base.simClock.simTime)
+
+    def updateSnapshot(self, dt):
+        """Reads the positions and velocities of all drones from the physics backend into the swarm arrays, this runs on every step
+            of the simulation clock right after the physics. Everything else reads the drones from this snapshot instead of asking the physics."""
+        self.swarm.gatherState()
+
+    def updateProximity(self, dt):
+        """Counts the near misses and collisions of this step."""
+        self.proximity.update(self.base.simClock.simTime)
+
+    def getPositions(self):
+        """Returns the snapshot of the positions of all drones as a numpy array of shape (drones, 3). It is overwritten on the next step."""
+        return self.swarm.positions[:self.swarm.count]
+
+    def getVelocities(self):
+        """Returns the snapshot of the velocities of all drones as a numpy array of shape (drones, 3). It is overwritten on the next step."""
+        return self.swarm.velocities[:self.swarm.count]
+
+    def updateChannel(self, dt):
+        """Delivers the positions that have arrived over the channel, this runs on every step of the simulation clock before the forces are computed."""
+        if self.channel is not None:
+            receivers, positions = self.channel.deliver(self.base.simClock.simTime)
+            self.swarm.wakeReceivers(receivers, positions)  # a settled drone wakes up when it learns that another drone came close
+
+    def updateForces(self, dt):
+        """Computes the forces acting on all drones, this runs on every step of the simulation clock."""
+        if self.useSwarmEngine:
+            self.swarm.update()
+        else:
+            for drone in self.drones:
+                drone.updateForces()
 
-        self.base.taskMgr.add(self.updateDronesTask, "UpdateDrones")
-        self.base.taskMgr.add(self.updateTimeslotTask, "UpdateTimeslot")
+    def publishSetpoints(self, dt):
+        """Hands the positions of this step to the setpoint streamer, if it is running."""
+        if self.streamer.isRunning:
+            n = self.swarm.count
+            self.streamer.publish(self.swarm.positions[:n])
 
     def updateDronesTask(self, task):
         """Run the update methods of all drones."""
-        for drone in self.drones:
-            drone.update()
+        profiler = self.base.profiler
+        with profiler.measure("UpdateDrones/Models"):
+            self.base.physics.syncNodes()
+            if self.droneModels is not None:
+                self.droneModels.update()
+        with profiler.measure("UpdateDrones/Drones"):
+            for drone in self.drones:
+                drone.update()
+        if self.debugLines is not None:
+            with profiler.measure("UpdateDrones/DebugLines"):
+                self.debugLines.update()
         return task.cont
 
     def updateTimeslotTask(self, task):
-        timeslotAmount = 2
-        task.delayTime = self.timeslotLengthMilli / 1000
+        """Lets the drones of the next timeslot send their positions."""
+        task.delayTime = self.tdma.getSlotDuration()
+        senders = self.tdma.advance(self.base.simClock.simTime)
+        self.updateNeighborIndex()
+        self.swarm.wakeNeighbors(senders)  # settled drones wake up when another drone comes close
 
-        self.currentTimeslot += 1
-        if self.currentTimeslot >= timeslotAmount:
-            self.currentTimeslot = 0
+        return task.again
 
-        for drone in self.drones:
-            drone.updateSentPosition(self.currentTimeslot)
+    def updateNeighborIndex(self):
+        """Rebuilds the spatial hash from the last sent positions. Has to be called whenever these positions change."""
+        self.neighborIndex.rebuild(self.swarm.lastSentPositions[:self.swarm.count])
 
-        return task.again
+    def getNearbyDroneCandidates(self, position: Vec3):
+        """Returns the drones whose last sent position might be within the sensor range of the supplied position."""
+        return [self.drones[i] for i in self.neighborIndex.query(position)]
+
+    def getKnownDronePositions(self, drone):
+        """Returns the positions of the other drones as known by the supplied drone as a numpy array of shape (drones, 3).
+            These are the received positions if a channel is simulated, otherwise the last sent positions of the nearby drones."""
+        if self.channel is not None:
+            return self.channel.getReceivedPositions(drone.index)
+        candidates = self.neighborIndex.query(self.swarm.positions[drone.index])
+        candidates = candidates[self.swarm.ids[candidates] != drone.id]  # prevent drone from detecting itself
+        return self.swarm.lastSentPositions[candidates]
 
     def initUI(self):
         # initialize drone control panel
@@ -130,6 +248,10 @@ class DroneManager(DirectObject.DirectObject):
         # initialize an UI element with all available formations
         loadFormationSelectionFrame(self)
 
+        # shows the progress of each drone while connecting
+        self.connectionText = OnscreenText(text="", parent=self.base.a2dTopRight, pos=(-0.05, -0.1), scale=0.04, fg=(1, 1, 1, 1),
+                                           bg=(0, 0, 0, 0.5), align=TextNode.ARight, mayChange=True)
+
 
     def startLandAll(self, button):
         if not self.isStarted:
@@ -179,25 +301,69 @@ class DroneManager(DirectObject.DirectObject):
 
 
     def toggleConnections(self, button):
-        """Connects/Disconnects the virtual drones to/from the real drones."""
+        """Connects/Disconnects the virtual drones to/from the real drones. The drones connect concurrently in the background,
+            each drone starts following its virtual drone as soon as it is connected."""
         # connect drones
         if not self.isConnected:
             self.isConnected = True
             button["text"] = "Disconnect"
             print("initializing drivers")
             cflib.crtp.init_drivers(enable_debug_driver=False)
+            # drones with a loopback:// uri are simulated, they start where their virtual drone is
+            registerLoopbackDriver(startPositions={drone.uri: tuple(drone.getPos()) for drone in self.connector.drones})
             print("connecting drones")
-            for drone in self.drones:
-                drone.connect()
-            # time.sleep(5)  # wait a moment so that the position estimator reports a consisten position
+            self.connector.connectAll()
+            self.publishSetpoints(0)
+            self.streamer.start()
+            self.linkHealth.start()
+            self.base.taskMgr.add(self.connectionProgressTask, "ConnectionProgress")
+            self.base.taskMgr.add(self.linkHealthTask, "LinkHealth")
         # disconnect drones
         else:
             self.isConnected = False
             button["text"] = "Connect"
             print("disconnecting drones")
-            for drone in self.drones:
-                if drone.isConnected:
-                    drone.disconnect()
+            self.base.taskMgr.remove("ConnectionProgress")
+            self.base.taskMgr.remove("LinkHealth")
+            self.linkHealth.stop()
+            self.connector.disconnectAll()
+            self.streamer.stop(wait=False)  # its workers disconnect the drones before they exit
+            if self.connectionText is not None:
+                self.connectionText.setText("")
+
+
+    def shutdown(self):
+        """Disconnects the real drones when the simulator exits and waits until the workers of the streamer are done with them."""
+        self.linkHealth.stop()
+        if self.isConnected:
+            self.isConnected = False
+            self.connector.disconnectAll()
+        self.streamer.stop()
+
+
+    def connectionProgressTask(self, task):
+        """Shows the progress of the drones that are connecting until all of them are done."""
+        if self.connectionText is not None:
+            self.connectionText.setText(self.connector.getProgress())
+        if self.connector.isDone():
+            connected = sum(drone.isConnected for drone in self.connector.drones)
+            print(f"{connected} of {len(self.connector.drones)} drones connected")
+            return task.done
+        return task.cont
+
+
+    def linkHealthTask(self, task):
+        """Reacts to the changes of the link health of the real drones. The virtual drone of a lost drone holds the last position
+            of the real one, so the other drones keep avoiding it until it is reconnected."""
+        changes = self.linkHealth.getChanges()
+        for drone, state in changes:
+            print(drone.uri, "link", state)
+            latest = self.telemetry.positions.latest(drone.telemetryRow)
+            if state == "lost" and latest is not None:
+                drone.setTarget(Vec3(*latest[1]))
+        if changes and self.connectionText is not None and self.connector.isDone():
+            self.connectionText.setText(self.linkHealth.getSummary())
+        return task.cont
 
 
     def applyFormation(self, formation):
@@ -240,10 +406,10 @@ class DroneManager(DirectObject.DirectObject):
             return
         if not self.isRotating:
             self.isRotating = True
-            self.base.taskMgr.doMethodLater(0, self.rotateFormationTask, "RotateDrones")
+            self.base.simClock.doMethodLater(0, self.rotateFormationTask, "RotateDrones")
         else:
             self.isRotating = False
-            self.base.taskMgr.remove("RotateDrones")
+            self.base.simClock.remove("RotateDrones")
 
 
     def rotateFormationTask(self, task):
@@ -268,17 +434,9 @@ class DroneManager(DirectObject.DirectObject):
 
 
     def getAllPositions(self):
-        """Returns a list of the positions of all drones. Usefull when recording their paths for later."""
-        lst = []
-        for drone in self.drones:
-            pos = drone.getPos()
-            lst.append([pos.x, pos.y, pos.z])
-        return lst
+        """Returns a copy of the positions of all drones. Usefull when recording their paths for later."""
+        return self.getPositions().copy()
 
     def getAllVelocities(self):
-        """Returns a list of the velocities of all drones. Usefull when recording their paths for later."""
-        lst = []
-        for drone in self.drones:
-            vel = drone.getVel()
-            lst.append([vel.x, vel.y, vel.z])
-        return lst
+        """Returns a copy of the velocities of all drones. Usefull when recording their paths for later."""
+        return self.getVelocities().copy()
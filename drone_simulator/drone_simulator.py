@@ -5,9 +5,16 @@ import time
 from camera_controller import CameraController
 from drone_manager import DroneManager
 from recorder import DroneRecorder
+from sim_clock import SimulationClock
+from physics import BulletPhysics
+from physics import PointMassPhysics
+from profiler import FrameProfiler
+from streaming import SetpointStreamer
+from loopback import registerLoopbackDriver
 
 from direct.showbase.ShowBase import ShowBase
 from panda3d.core import Filename
+from panda3d.core import loadPrcFileData
 from panda3d.core import DirectionalLight
 from panda3d.core import AntialiasAttrib
 from panda3d.core import Vec3
@@ -22,30 +29,53 @@ from panda3d.bullet import BulletDebugNode
 class DroneSimulator(ShowBase):
     """The main class of this project. Execute this to start the drone simulation."""
 
-    def __init__(self, droneList):
+    def __init__(self, droneList, headless=False, fastForward=False, timeslotLengthMilli=120, guardTimeMilli=0, physicsBackend="bullet", profile=False, workers=0,
+                 setpointRate=SetpointStreamer.RATE, setpointThreshold=SetpointStreamer.THRESHOLD):
+        # in headless mode no window is opened and nothing is rendered, only the drones, physics and the recorder are running
+        self.headless = headless
+        if self.headless:
+            loadPrcFileData("", "window-type none")
+            loadPrcFileData("", "audio-library-name null")
         ShowBase.__init__(self)
 
-        # set resolution
-        wp = WindowProperties()
-        # wp.setSize(2000, 1500)
-        wp.setSize(1200, 900)
-        # wp.setSize(800, 600)
-        self.win.requestProperties(wp)
+        # measures the time of each task per frame, the statistics are exported on exit
+        self.profiler = FrameProfiler(self, enabled=profile)
 
-        self.setFrameRateMeter(True)
-        self.render.setAntialias(AntialiasAttrib.MAuto)
-        CameraController(self)
+        if not self.headless:
+            # set resolution
+            wp = WindowProperties()
+            # wp.setSize(2000, 1500)
+            wp.setSize(1200, 900)
+            # wp.setSize(800, 600)
+            self.win.requestProperties(wp)
+
+            self.setFrameRateMeter(True)
+            self.render.setAntialias(AntialiasAttrib.MAuto)
+            CameraController(self)
 
         # setup model directory
         self.modelDir = os.path.abspath(sys.path[0])  # Get the location of the 'py' file I'm running:
         self.modelDir = Filename.from_os_specific(self.modelDir).getFullpath() + "/models"  # Convert that to panda's unix-style notation.
 
-        self.initScene()
-        self.initBullet()
+        if not self.headless:
+            self.initScene()
+
+        # physics, drones and recorder run on a fixed step clock, in fast forward mode the simulation runs faster than real time
+        self.simClock = SimulationClock(self, fastForward=fastForward)
+        # the drones are either simulated as Bullet rigid bodies or, for big swarms, as point masses directly in numpy
+        if physicsBackend == "bullet":
+            self.initBullet()
+            self.physics = BulletPhysics(self.world)
+        elif physicsBackend == "numpy":
+            self.physics = PointMassPhysics()
+        else:
+            raise ValueError(f"Unknown physics backend {physicsBackend}")
+        self.simClock.addStepCallback(self.updatePhysics, "UpdatePhysics")
 
-        delay = 120
-        self.droneManager = DroneManager(self, droneList, delay)
-        DroneRecorder(self.droneManager, delay)
+        delay = timeslotLengthMilli
+        self.droneManager = DroneManager(self, droneList, delay, headless=self.headless, guardTimeMilli=guardTimeMilli, workers=workers,
+                                         setpointRate=setpointRate, setpointThreshold=setpointThreshold)
+        self.droneRecorder = DroneRecorder(self.droneManager, delay)
 
         self.stopwatchOn = False
         self.now = 0
@@ -55,10 +85,10 @@ class DroneSimulator(ShowBase):
     def toggleStopwatch(self):
         if not self.stopwatchOn:
             self.stopwatchOn = True
-            self.now = time.time()
+            self.now = self.simClock.simTime
         else:
             self.stopwatchOn = False
-            print(f"{time.time() - self.now},")
+            print(f"{self.simClock.simTime - self.now},")
 
 
     def initScene(self):
@@ -81,7 +111,7 @@ class DroneSimulator(ShowBase):
 
 
     def initBullet(self):
-        """Initializes the Bullet physics engine, also adds the updatePhysicsTask to the task manager."""
+        """Initializes the Bullet physics engine."""
         self.world = BulletWorld()
         self.world.setGravity(Vec3(0, 0, 0))
 
@@ -92,7 +122,12 @@ class DroneSimulator(ShowBase):
         np.setPos(0, 0, 0)
         self.world.attachRigidBody(node)
 
-        # add debug node
+        if not self.headless:
+            self.initBulletDebugNode()
+
+
+    def initBulletDebugNode(self):
+        """Adds a debug node which visualizes the Bullet world."""
         debugNode = BulletDebugNode("Debug")
         debugNode.showWireframe(False)
         debugNode.showConstraints(True)
@@ -102,24 +137,15 @@ class DroneSimulator(ShowBase):
         debugNP.show()
         self.world.setDebugNode(debugNP.node())
 
-        self.taskMgr.add(self.updatePhysicsTask, "UpdatePhysics")
-
-
-    def updatePhysicsTask(self, task):
-        dt = self.taskMgr.globalClock.getDt()
-
-        # self.dtSum += dt
-        # self.accumulator += 1
-        # print(self.dtSum / self.accumulator)
-        # print(dt)
 
-        self.world.doPhysics(dt)
-        return task.cont
+    def updatePhysics(self, dt):
+        """Advances the physics by exactly one step of the simulation clock."""
+        self.physics.step(dt)
 
 
 if __name__ == "__main__":
     # add drones you want to spawn to the droneList, with an initial position and a uri of a real drone if applicable
-    # if the drone should not be able to connect, put -1 as uri
+    # if the drone should not be able to connect, put -1 as uri and add a unique id as third element
     droneList = []
 
     dist = 0.7
@@ -135,5 +161,25 @@ if __name__ == "__main__":
     # droneList.append([Vec3(-dist, -dist - .5, .3), 'radio://1/70/2M/E7E7E7E7E9'])
 
 
-    app = DroneSimulator(droneList)
+    # start with --headless to run the simulation without a window, e.g. on a server
+    # and with --fast to run the simulation as fast as possible instead of in real time
+    # with --profile the time each task takes is shown in an overlay (toggled with p) and saved to the profiles folder on exit
+    # with --numpy the drones are simulated as point masses instead of Bullet bodies, which is a lot faster for big swarms
+    # and with --workers n the point masses are partitioned across n worker processes, for swarms of thousands of drones
+    # with --rate n the setpoints are sent to the real drones n times per second
+    # and with --threshold m only once they moved m meters, drones that don't move only get a keepalive
+    # and with --loopback the real drones are replaced by simulated ones, to test the connection code without hardware
+    # their links delay each packet by --latency ms, which varies by --jitter ms, and lose setpoints and log data with the probability --loss
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 0
+    setpointRate = float(sys.argv[sys.argv.index("--rate") + 1]) if "--rate" in sys.argv else SetpointStreamer.RATE
+    setpointThreshold = float(sys.argv[sys.argv.index("--threshold") + 1]) if "--threshold" in sys.argv else SetpointStreamer.THRESHOLD
+    if "--loopback" in sys.argv:
+        droneList = [[position, uri.replace("radio://", "loopback://")] for position, uri in droneList]
+        latencyMilli = float(sys.argv[sys.argv.index("--latency") + 1]) if "--latency" in sys.argv else 0
+        jitterMilli = float(sys.argv[sys.argv.index("--jitter") + 1]) if "--jitter" in sys.argv else 0
+        lossProbability = float(sys.argv[sys.argv.index("--loss") + 1]) if "--loss" in sys.argv else 0
+        registerLoopbackDriver(latencyMilli, jitterMilli, lossProbability)
+    physicsBackend = "numpy" if "--numpy" in sys.argv or workers > 0 else "bullet"
+    app = DroneSimulator(droneList, headless="--headless" in sys.argv, fastForward="--fast" in sys.argv, physicsBackend=physicsBackend, profile="--profile" in sys.argv, workers=workers,
+                         setpointRate=setpointRate, setpointThreshold=setpointThreshold)
     app.run()
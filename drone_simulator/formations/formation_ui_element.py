@@ -11,13 +11,7 @@ def loadFormationSelectionFrame(manager):
         Formations are .csv files where the nth line is the x, y, z coordinate of the nth drone."""
     # manager = manager
 
-    formations = []  # a list of formations, which are lists consisting of the name and the positions as a numpy array
-    # load all .txt files in the formations folder
-    directory = os.path.dirname(os.path.abspath(__file__))  # the directory this.py file is in, which also contains the formation files
-    for file in os.listdir(directory):
-        if file.endswith(".csv"):
-            path = os.path.join(directory, file)
-            formations.append(_loadFormation(path))
+    formations = loadFormations()
 
     # size and position of the buttons and the scrollable frame
     buttonSize = (-8, 8, -.2, .8)
@@ -40,6 +34,19 @@ def loadFormationSelectionFrame(manager):
     print("{} formations loaded.".format(len(formations)))
 
 
+def loadFormations():
+    """Loads all formation files in the same directory as this .py file.
+        Returns a list of formations, which are lists consisting of the name and the positions as a numpy array."""
+    formations = []
+    # load all .csv files in the formations folder
+    directory = os.path.dirname(os.path.abspath(__file__))  # the directory this.py file is in, which also contains the formation files
+    for file in sorted(os.listdir(directory)):
+        if file.endswith(".csv"):
+            path = os.path.join(directory, file)
+            formations.append(_loadFormation(path))
+    return formations
+
+
 def _loadFormation(path: str):
     """Loads the formation file at the specified path and returns a list containing its name and the drone positions as a numpy array"""
     name = ntpath.basename(path)
@@ -0,0 +1,206 @@
+import time
+import queue
+import threading
+
+
+class LinkHealth:
+    """The health of the link to one real drone. The callbacks of its Crazyflie and the RadioWorker write into it,
+        the LinkHealthMonitor evaluates it. The state is "ok", "degraded", "lost" or "reconnecting"."""
+
+    def __init__(self, retryDelay):
+        self.state = "ok"
+        self.firstRetryDelay = retryDelay
+        self.retryDelay = retryDelay  # seconds until the next attempt to reconnect, doubled after every failed attempt
+        self.nextAttemptTime = 0
+        self.attemptTime = 0  # when the current attempt to reconnect started
+        self.attemptThread = None  # the thread of the current attempt, attempts that were given up on don't change the state
+        self.attempts = 0
+        self.reset()
+
+
+    def reset(self):
+        """Starts tracking a freshly opened link."""
+        self.openTime = time.monotonic()
+        self.lastPacketTime = self.openTime  # any packet from the drone counts, the log packets arrive at least every SLOWPERIOD
+        self.linkQuality = 100  # percent, reported by the radio from the retries it needed to get the packets acknowledged
+        self.isLinkLost = False  # set once cflib gave up on the link
+        self.sendFailures = 0  # setpoints that could not be sent, counted by the RadioWorker
+        self.checkedSendFailures = 0
+
+
+    def onPacketReceived(self, pk):
+        self.lastPacketTime = time.monotonic()
+
+
+    def onLinkQualityUpdated(self, quality):
+        self.linkQuality = quality
+
+
+    def onConnectionLost(self, uri, message):
+        self.isLinkLost = True
+
+
+class LinkHealthMonitor:
+    """Watches the links to the real drones in a background thread. A drone is degraded if its position is older than a few log
+        periods, the radio reports a bad link quality or setpoints failed to send, and lost if nothing was received for LOSTAGE or
+        cflib reported the link as lost. The streamer stops sending to a lost drone and it is reconnected in a thread of its own,
+        after a delay that doubles with every failed attempt. An attempt that takes longer than CONNECTTIMEOUT counts as failed. Nothing here blocks, the DroneManager reads the changes of the states
+        on every frame and the render loop never waits for a link."""
+
+    CHECKINTERVAL = 0.1  # seconds between two checks of all drones
+    STALEPERIODS = 3  # log periods without a position until a drone is degraded
+    STALEAGE = 0.3  # seconds, the shortest time without a position until a drone is degraded
+    LOSTAGE = 2  # seconds without any packet until a drone is lost
+    DEGRADEDQUALITY = 50  # percent
+    RETRYDELAY = 1  # seconds before the first attempt to reconnect
+    MAXRETRYDELAY = 16
+    CONNECTTIMEOUT = 15  # seconds for one attempt to reconnect
+    CONNECTGRACE = 5  # seconds an attempt may take beyond its timeout, e.g. to close the link, until it is given up on
+
+    def __init__(self, drones, telemetry):
+        self.drones = [drone for drone in drones if drone.canConnect]
+        self.telemetry = telemetry
+        for drone in self.drones:
+            drone.linkHealth = LinkHealth(self.RETRYDELAY)
+        self.changes = queue.SimpleQueue()  # (drone, state) for every change of a state
+        self.isRunning = False
+        self.thread = None
+
+
+    def watch(self, drone):
+        """Starts tracking the link of the supplied drone, called by the drone once its link is open."""
+        health = drone.linkHealth
+        health.reset()
+        cf = drone.scf.cf
+        cf.packet_received.add_callback(health.onPacketReceived)
+        # newer cflib versions moved the link quality into the link statistics
+        getattr(cf, "link_statistics", cf).link_quality_updated.add_callback(health.onLinkQualityUpdated)
+        cf.connection_lost.add_callback(health.onConnectionLost)
+        self._setState(drone, "ok")
+
+
+    def start(self):
+        """Starts checking the drones in the background, does nothing if it is already running. The drones are connected again
+            by the SwarmConnector, so the drones that were lost in the last session start out as ok."""
+        if self.isRunning:
+            return
+        for drone in self.drones:
+            health = drone.linkHealth
+            health.attemptThread = None
+            health.attempts = 0
+            health.retryDelay = health.firstRetryDelay
+            self._setState(drone, "ok")
+        self.isRunning = True
+        self.thread = threading.Thread(target=self._run, name="LinkHealthMonitor", daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        """Stops checking the drones and gives up on reconnecting them, returns right away."""
+        self.isRunning = False
+
+
+    def _run(self):
+        while self.isRunning:
+            now = time.monotonic()
+            for drone in self.drones:
+                self._check(drone, now)
+            time.sleep(self.CHECKINTERVAL)
+
+
+    def _check(self, drone, now):
+        health = drone.linkHealth
+        if health.state == "reconnecting":
+            if now - health.attemptTime > self.CONNECTTIMEOUT + self.CONNECTGRACE:
+                print(drone.uri, f"gave up on reconnecting, attempt {health.attempts} hangs")
+                self._retryLater(drone)
+            return
+        if health.state == "lost":
+            if now >= health.nextAttemptTime:
+                health.attempts += 1
+                health.attemptTime = now
+                health.attemptThread = threading.Thread(target=self._reconnect, args=(drone,), name=f"Reconnect {drone.uri}", daemon=True)
+                self._setState(drone, "reconnecting")
+                health.attemptThread.start()
+            return
+        if not drone.isConnected:  # still connecting or disconnected on purpose
+            return
+
+        if health.isLinkLost or now - health.lastPacketTime > self.LOSTAGE:
+            drone.isConnected = False  # the streamer stops sending to the dead link
+            drone.connectionState = "lost"
+            health.nextAttemptTime = now + health.retryDelay
+            self._setState(drone, "lost")
+            return
+
+        latest = self.telemetry.positions.latest(drone.telemetryRow)
+        positionTime = health.openTime if latest is None else max(latest[0], health.openTime)
+        isStale = now - positionTime > max(self.STALEPERIODS * drone.telemetryPeriod, self.STALEAGE)
+        sendFailed = health.sendFailures > health.checkedSendFailures
+        health.checkedSendFailures = health.sendFailures
+        isDegraded = isStale or sendFailed or health.linkQuality < self.DEGRADEDQUALITY
+        self._setState(drone, "degraded" if isDegraded else "ok")
+
+
+    def _reconnect(self, drone):
+        """Opens a new link to a lost drone, this runs in a thread of its own. Its estimator kept running, so it isn't reset.
+            If the attempt was given up on in the meantime, or the monitor was restarted, the state is left to the others."""
+        health = drone.linkHealth
+        print(drone.uri, f"reconnecting, attempt {health.attempts}")
+        try:
+            drone.scf.close_link()
+        except Exception:
+            pass
+        try:
+            drone.connect(time.monotonic() + self.CONNECTTIMEOUT, resetEstimator=False)
+        except Exception as e:
+            print(drone.uri, "failed to reconnect:", e)
+            try:
+                drone.scf.close_link()
+            except Exception:
+                pass
+            if health.attemptThread is threading.current_thread():
+                self._retryLater(drone)
+            return
+
+        if health.attemptThread is not threading.current_thread() or not self.isRunning:  # disconnected while reconnecting
+            drone.isConnected = False
+            drone.scf.close_link()
+            drone.connectionState = "disconnected"
+            return
+        health.attemptThread = None
+        health.retryDelay = health.firstRetryDelay
+        health.attempts = 0
+
+
+    def _retryLater(self, drone):
+        """Marks the drone as lost until its next attempt to reconnect, which is after the current retry delay."""
+        health = drone.linkHealth
+        health.attemptThread = None
+        drone.isConnected = False
+        drone.connectionState = "lost"
+        health.nextAttemptTime = time.monotonic() + health.retryDelay
+        health.retryDelay = min(2 * health.retryDelay, self.MAXRETRYDELAY)
+        self._setState(drone, "lost")
+
+
+    def _setState(self, drone, state):
+        if drone.linkHealth.state != state:
+            drone.linkHealth.state = state
+            self.changes.put((drone, state))
+
+
+    def getChanges(self) -> list:
+        """Returns the (drone, state) changes since the last call, without waiting."""
+        changes = []
+        while not self.changes.empty():
+            changes.append(self.changes.get_nowait())
+        return changes
+
+
+    def getSummary(self) -> str:
+        """Returns a line for the whole swarm followed by one line per drone that is not ok, e.g. for an onscreen text."""
+        unhealthy = [drone for drone in self.drones if drone.linkHealth.state != "ok"]
+        lines = [f"{len(self.drones) - len(unhealthy)}/{len(self.drones)} links ok"]
+        lines += [f"{drone.uri}: {drone.linkHealth.state}, link quality {drone.linkHealth.linkQuality:.0f}%" for drone in unhealthy]
+        return "\n".join(lines)
@@ -0,0 +1,91 @@
+import numpy as np
+
+from panda3d.core import GeomEnums
+from panda3d.core import OmniBoundingVolume
+from panda3d.core import Shader
+from panda3d.core import Texture
+
+
+VERTEXSHADER = """
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform samplerBuffer instanceData;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+
+out vec3 normal;
+
+void main() {
+    // the model sits at the origin of the scene, each instance is moved to the position of its drone
+    vec3 offset = texelFetch(instanceData, gl_InstanceID).xyz;
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(p3d_Vertex.xyz + offset, 1);
+    normal = p3d_Normal;
+}
+"""
+
+FRAGMENTSHADER = """
+#version 150
+
+uniform struct p3d_MaterialParameters {
+    vec4 diffuse;
+} p3d_Material;
+
+in vec3 normal;
+
+out vec4 fragColor;
+
+void main() {
+    // a simple approximation of the directional lights of the scene
+    float light = 0.3 + 0.7 * max(dot(normalize(normal), normalize(vec3(-0.4, 0.3, 0.8))), 0);
+    fragColor = vec4(p3d_Material.diffuse.rgb * light, 1);
+}
+"""
+
+
+class InstancedDroneModels:
+    """Draws the models of all drones with a single hardware instanced model. The positions of the instances are read from
+        the swarm arrays and written to a buffer texture every frame, so the amount of nodes and draw calls does not grow with the swarm."""
+
+    MODELSCALE = 0.2
+
+    def __init__(self, base, swarm):
+        self.swarm = swarm
+        self.capacity = 0  # the amount of instances the buffer texture has room for
+
+        # bake the scale into the vertices, so the shader only has to add the position of each drone
+        self.nodePath = base.loader.loadModel(base.modelDir + "/drones/drone1.egg")
+        self.nodePath.setScale(self.MODELSCALE)
+        self.nodePath.flattenStrong()
+        self.nodePath.reparentTo(base.render)
+        # the bounds of the model only cover the origin, the instances can be anywhere
+        self.nodePath.node().setBounds(OmniBoundingVolume())
+        self.nodePath.node().setFinal(True)
+        self.nodePath.setShader(Shader.make(Shader.SL_GLSL, VERTEXSHADER, FRAGMENTSHADER))
+
+        self.instanceData = Texture("DroneInstances")
+        self._allocate(16)
+
+
+    @staticmethod
+    def isSupported(base) -> bool:
+        """Returns true if the graphics card supports instancing and buffer textures."""
+        gsg = base.win.getGsg() if base.win is not None else None
+        return gsg is not None and gsg.getSupportsGeometryInstancing() and gsg.getSupportsBufferTexture() and gsg.getSupportsGlsl()
+
+
+    def update(self):
+        """Moves the instances to the current positions of the drones."""
+        n = self.swarm.count
+        if n > self.capacity:
+            self._allocate(max(n, 2 * self.capacity))
+        instances = np.frombuffer(memoryview(self.instanceData.modifyRamImage()).cast("B"), dtype=np.float32).reshape(-1, 4)
+        instances[:n, :3] = self.swarm.positions[:n]
+        self.nodePath.setInstanceCount(n)
+
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.instanceData.setupBufferTexture(capacity, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.nodePath.setShaderInput("instanceData", self.instanceData)
@@ -0,0 +1,398 @@
+import math
+import time
+import heapq
+import random
+import struct
+import zlib
+import threading
+import itertools
+
+import numpy as np
+
+import cflib.crtp
+from cflib.crtp.crtpdriver import CRTPDriver
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+from cflib.crtp.exceptions import WrongUriType
+
+
+SCHEME = "loopback://"
+
+# the log variables of the simulated firmware with their type ids, see cflib.crazyflie.log.LogTocElement
+LOGVARIABLES = [
+    ("kalman.stateX", 0x07), ("kalman.stateY", 0x07), ("kalman.stateZ", 0x07),
+    ("kalman.statePX", 0x07), ("kalman.statePY", 0x07), ("kalman.statePZ", 0x07),
+    ("kalman.varPX", 0x07), ("kalman.varPY", 0x07), ("kalman.varPZ", 0x07),
+    ("pm.vbat", 0x07),
+]
+# the parameters of the simulated firmware with their type ids, see cflib.crazyflie.param.ParamTocElement
+PARAMETERS = [
+    ("kalman.resetEstimation", 0x08), ("flightmode.posSet", 0x08), ("commander.enHighLevel", 0x08),
+    ("stabilizer.controller", 0x08), ("stabilizer.estimator", 0x08),
+]
+# the struct formats of the log types
+LOGFORMATS = {0x01: "<B", 0x02: "<H", 0x03: "<L", 0x04: "<b", 0x05: "<h", 0x06: "<i", 0x07: "<f", 0x08: "<e"}
+PARAMFORMATS = {0x08: "<B"}
+
+# commands of the toc, log and param ports, see cflib.crazyflie.toc and cflib.crazyflie.log
+CMD_TOC_ELEMENT = 0
+CMD_TOC_INFO = 1
+CMD_TOC_ITEM_V2 = 2
+CMD_TOC_INFO_V2 = 3
+CMD_CREATE_BLOCK = 0
+CMD_APPEND_BLOCK = 1
+CMD_DELETE_BLOCK = 2
+CMD_START_LOGGING = 3
+CMD_STOP_LOGGING = 4
+CMD_RESET_LOGGING = 5
+CMD_CREATE_BLOCK_V2 = 6
+CMD_APPEND_BLOCK_V2 = 7
+ENOENT = 2
+EEXIST = 17
+TYPE_STOP = 0
+TYPE_POSITION = 7
+
+
+class LoopbackFirmware:
+    """Answers the CRTP packets of cflib like the firmware of a Crazyflie would, as far as the simulator uses it: the protocol
+        version, the log and param tocs, parameter reads and writes, log blocks and position setpoints. The drone is a point
+        that follows its position setpoint with a first order lag. After the estimator is reset with kalman.resetEstimation,
+        the kalman variances decay over CONVERGENCETIME, so waiting for the estimator takes about as long as with a real drone."""
+
+    PROTOCOLVERSION = 4
+    TIMECONSTANT = 0.3  # seconds, the time constant with which the drone follows its setpoint
+    MAXSPEED = 1.0  # meters per second
+    INITIALVARIANCE = 0.05  # the kalman variance right after a reset
+    VARIANCEFLOOR = 0.0001  # the kalman variance once the estimator has converged
+    CONVERGENCETIME = 0.5  # seconds, the time constant of the variance after a reset
+    BATTERYDRAIN = 0.0005  # volts per second
+
+    def __init__(self, position):
+        self.startTime = time.monotonic()
+        self.lastUpdateTime = self.startTime
+        self.resetTime = self.startTime
+        self.position = np.array(position, dtype=float)
+        self.velocity = np.zeros(3)
+        self.setpoint = None  # the drone holds its position without a setpoint
+        self.parameters = {name: 0 for name, _ in PARAMETERS}
+        self.blocks = {}  # log block id: {"variables", "period", "nextTime"}, the next time is None while the block is stopped
+        self.useV2 = False  # set once cflib asks for a toc with the version 2 commands
+
+        self.logCrc = zlib.crc32(",".join(name for name, _ in LOGVARIABLES).encode())
+        self.paramCrc = zlib.crc32(",".join(name for name, _ in PARAMETERS).encode())
+
+
+    def handle(self, pk, now) -> list:
+        """Handles a packet sent by cflib and returns the answers."""
+        self.update(now)
+        data = bytes(pk.data)
+        if pk.port == CRTPPort.LINKCTRL:
+            if pk.channel == 0:  # echo, e.g. to measure the latency
+                return [self._packet(pk.port, 0, data)]
+            if pk.channel == 1:  # source, the magic string tells cflib it can ask for the protocol version
+                return [self._packet(pk.port, 1, b"Bitcraze Crazyflie")]
+        elif pk.port == CRTPPort.PLATFORM:
+            if pk.channel == 1 and data[:1] == b"\x00":
+                return [self._packet(pk.port, 1, bytes((0, self.PROTOCOLVERSION)))]
+        elif pk.port == CRTPPort.MEM:
+            if pk.channel == 0 and data[:1] == b"\x01":  # the simulated drone has no memories
+                return [self._packet(pk.port, 0, bytes((1, 0)))]
+        elif pk.port == CRTPPort.LOGGING:
+            if pk.channel == 0:
+                return self._handleToc(pk.port, data, LOGVARIABLES, self.logCrc)
+            if pk.channel == 1:
+                return self._handleLogSettings(data)
+        elif pk.port == CRTPPort.PARAM:
+            if pk.channel == 0:
+                return self._handleToc(pk.port, data, PARAMETERS, self.paramCrc)
+            if pk.channel in (1, 2):
+                return self._handleParam(pk.channel, data, now)
+        elif pk.port == CRTPPort.COMMANDER_GENERIC:
+            if data[0] == TYPE_POSITION:
+                self.setpoint = np.array(struct.unpack("<fff", data[1:13]), dtype=float)
+            elif data[0] == TYPE_STOP:
+                self.setpoint = None
+        elif pk.port == CRTPPort.COMMANDER:  # cflib sends an empty setpoint when closing the link
+            self.setpoint = None
+        return []
+
+
+    def _handleToc(self, port, data, elements, crc) -> list:
+        command = data[0]
+        if command == CMD_TOC_INFO:
+            return [self._packet(port, 0, struct.pack("<BBIBB", command, len(elements), crc, 16, 128))]
+        if command == CMD_TOC_INFO_V2:
+            self.useV2 = True
+            return [self._packet(port, 0, struct.pack("<BHIBB", command, len(elements), crc, 16, 128))]
+        if command == CMD_TOC_ELEMENT:
+            index = data[1]
+            header = bytes((command, index))
+        elif command == CMD_TOC_ITEM_V2:
+            index = data[1] | data[2] << 8
+            header = bytes((command, data[1], data[2]))
+        else:
+            return []
+        if index >= len(elements):
+            return []
+        name, typeId = elements[index]
+        group, variable = name.split(".")
+        return [self._packet(port, 0, header + bytes((typeId,)) + group.encode() + b"\x00" + variable.encode() + b"\x00")]
+
+
+    def _handleLogSettings(self, data) -> list:
+        command = data[0]
+        if command == CMD_RESET_LOGGING:
+            self.blocks = {}
+            return [self._packet(CRTPPort.LOGGING, 1, bytes((command, 0, 0)))]
+        blockId = data[1]
+        status = 0
+        if command in (CMD_CREATE_BLOCK, CMD_CREATE_BLOCK_V2, CMD_APPEND_BLOCK, CMD_APPEND_BLOCK_V2):
+            if command in (CMD_CREATE_BLOCK, CMD_CREATE_BLOCK_V2):
+                if blockId in self.blocks:
+                    return [self._packet(CRTPPort.LOGGING, 1, bytes((command, blockId, EEXIST)))]
+                self.blocks[blockId] = {"variables": [], "period": 0.1, "nextTime": None}
+            elif blockId not in self.blocks:
+                return [self._packet(CRTPPort.LOGGING, 1, bytes((command, blockId, ENOENT)))]
+            # each variable is the byte with its types followed by its id in the toc
+            entrySize = 3 if command in (CMD_CREATE_BLOCK_V2, CMD_APPEND_BLOCK_V2) else 2
+            for i in range(2, len(data) - entrySize + 1, entrySize):
+                ident = data[i + 1] if entrySize == 2 else data[i + 1] | data[i + 2] << 8
+                self.blocks[blockId]["variables"].append((ident, data[i] & 0x0F))
+        elif blockId not in self.blocks:
+            status = ENOENT
+        elif command == CMD_DELETE_BLOCK:
+            del self.blocks[blockId]
+        elif command == CMD_START_LOGGING:
+            self.blocks[blockId]["period"] = data[2] * 0.01  # in 10 ms
+            self.blocks[blockId]["nextTime"] = time.monotonic()
+        elif command == CMD_STOP_LOGGING:
+            self.blocks[blockId]["nextTime"] = None
+        return [self._packet(CRTPPort.LOGGING, 1, bytes((command, blockId, status)))]
+
+
+    def _handleParam(self, channel, data, now) -> list:
+        idSize = 2 if self.useV2 else 1
+        ident = data[0] if idSize == 1 else data[0] | data[1] << 8
+        if ident >= len(PARAMETERS):
+            return []
+        name, typeId = PARAMETERS[ident]
+        if channel == 2:  # write
+            self.parameters[name] = struct.unpack(PARAMFORMATS[typeId], data[idSize:])[0]
+            if name == "kalman.resetEstimation" and self.parameters[name] != 0:
+                self.resetTime = now
+        value = struct.pack(PARAMFORMATS[typeId], self.parameters[name])
+        if channel == 1 and self.useV2:  # reads answer with a status byte
+            return [self._packet(CRTPPort.PARAM, channel, data[:idSize] + b"\x00" + value)]
+        return [self._packet(CRTPPort.PARAM, channel, data[:idSize] + value)]
+
+
+    def update(self, now):
+        """Moves the drone towards its setpoint."""
+        dt = now - self.lastUpdateTime
+        self.lastUpdateTime = now
+        if self.setpoint is None:
+            self.velocity[:] = 0
+            return
+        self.velocity = (self.setpoint - self.position) / self.TIMECONSTANT
+        speed = np.linalg.norm(self.velocity)
+        if speed > self.MAXSPEED:
+            self.velocity *= self.MAXSPEED / speed
+        self.position += self.velocity * min(dt, self.TIMECONSTANT)
+
+
+    def poll(self, now) -> list:
+        """Returns the packets of all log blocks that are due."""
+        packets = []
+        for blockId, block in self.blocks.items():
+            if block["nextTime"] is None or block["nextTime"] > now:
+                continue
+            if not packets:
+                self.update(now)
+            block["nextTime"] = max(block["nextTime"] + block["period"], now)
+            timestamp = int((now - self.startTime) * 1000) & 0xFFFFFF
+            data = bytes((blockId, timestamp & 0xFF, timestamp >> 8 & 0xFF, timestamp >> 16))
+            for ident, fetchAs in block["variables"]:
+                data += struct.pack(LOGFORMATS[fetchAs], self._logValue(LOGVARIABLES[ident][0], now))
+            packets.append(self._packet(CRTPPort.LOGGING, 2, data))
+        return packets
+
+
+    def nextLogTime(self) -> float:
+        return min((block["nextTime"] for block in self.blocks.values() if block["nextTime"] is not None), default=math.inf)
+
+
+    def _logValue(self, name, now) -> float:
+        group, variable = name.split(".")
+        if variable.startswith("state"):
+            axis = "XYZ".index(variable[-1])
+            return self.velocity[axis] if variable.startswith("stateP") else self.position[axis]
+        if variable.startswith("varP"):
+            return self.VARIANCEFLOOR + self.INITIALVARIANCE * math.exp(-(now - self.resetTime) / self.CONVERGENCETIME)
+        if name == "pm.vbat":
+            return 4.2 - self.BATTERYDRAIN * (now - self.startTime)
+        return 0
+
+
+    def _packet(self, port, channel, data) -> CRTPPacket:
+        pk = CRTPPacket()
+        pk.set_header(port, channel)
+        pk.data = data
+        return pk
+
+
+class LoopbackDriver(CRTPDriver):
+    """A CRTP link to a LoopbackFirmware running in a thread of its own instead of a Crazyflie behind a Crazyradio, so the
+        connection code can be tested, and the setpoint streaming load tested with dozens of drones, without any hardware.
+        Each packet is delayed by a normally distributed latency in both directions, and setpoints and log data are lost with lossProbability.
+        The class attributes are the configuration of all links and are set by registerLoopbackDriver(). The links to the uris
+        in cutUris lose the setpoints and log data and hold the other packets until the cut ends, like a radio that keeps retrying
+        them, and if the cut lasts longer than LINKERRORTIME they report an error, like a radio that doesn't get any acks."""
+
+    LINKERRORTIME = 1  # seconds
+
+    latencyMilli = 0
+    jitterMilli = 0
+    lossProbability = 0
+    startPositions = {}  # uri: the position the simulated drone starts at, (0, 0, 0) for other uris
+    cutUris = set()  # e.g. to test reconnecting, a uri can be added while its link is open
+
+    def __init__(self):
+        super().__init__()
+        self.uri = None
+        self.linkErrorCallback = None
+        self.firmware = None
+        self.isRunning = False
+        self.condition = threading.Condition()
+        self.toHost = []  # heaps of (delivery time, sequence number, packet)
+        self.toDrone = []
+        self.lastDelivery = {"toHost": 0, "toDrone": 0}  # the packets of one direction never overtake each other
+        self.sequence = itertools.count()
+
+
+    def connect(self, uri, linkQualityCallback=None, linkErrorCallback=None):
+        if not uri.startswith(SCHEME):
+            raise WrongUriType("Not a loopback uri")
+        self.uri = uri
+        self.linkErrorCallback = linkErrorCallback
+        self.firmware = LoopbackFirmware(self.startPositions.get(uri, (0, 0, 0)))
+        self.isRunning = True
+        self.thread = threading.Thread(target=self._run, name=f"Loopback {uri}", daemon=True)
+        self.thread.start()
+
+
+    def send_packet(self, pk):
+        with self.condition:
+            self._enqueue(self.toDrone, "toDrone", CRTPPacket(pk.header, pk.data))
+
+
+    def receive_packet(self, wait=0):
+        deadline = math.inf if wait < 0 else time.monotonic() + wait
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                isCut = self.uri in self.cutUris
+                if self.toHost and self.toHost[0][0] <= now and not isCut:
+                    return heapq.heappop(self.toHost)[2]
+                nextTime = min(deadline, self.toHost[0][0] if self.toHost and not isCut else math.inf)  # the end of a cut is notified
+                if nextTime <= now or not self.isRunning:
+                    return None
+                self.condition.wait(None if nextTime == math.inf else nextTime - now)
+
+
+    def _enqueue(self, queue, direction, pk):
+        """Puts a packet on its way unless it is lost, has to be called with the condition held."""
+        if self._isLossy(pk) and (self.uri in self.cutUris or random.random() < self.lossProbability):
+            return
+        latency = max(random.gauss(self.latencyMilli, self.jitterMilli), 0) / 1000 if self.jitterMilli > 0 else self.latencyMilli / 1000
+        deliveryTime = max(time.monotonic() + latency, self.lastDelivery[direction])
+        self.lastDelivery[direction] = deliveryTime
+        heapq.heappush(queue, (deliveryTime, next(self.sequence), pk))
+        self.condition.notify_all()
+
+
+    def _isLossy(self, pk) -> bool:
+        """Only setpoints, log data and pings are lost. cflib doesn't resend some of the packets of the connection setup,
+            with a real radio they get through because the radio retries them itself."""
+        if pk.port in (CRTPPort.COMMANDER, CRTPPort.COMMANDER_GENERIC):
+            return True
+        return (pk.port == CRTPPort.LOGGING and pk.channel == 2) or (pk.port == CRTPPort.LINKCTRL and pk.channel == 0)
+
+
+    def _run(self):
+        """The main loop of the simulated drone, answers the packets that have arrived and sends the log blocks that are due."""
+        cutTime = None
+        with self.condition:
+            while self.isRunning:
+                now = time.monotonic()
+                isCut = self.uri in self.cutUris
+                if isCut:
+                    cutTime = now if cutTime is None else cutTime
+                    if now - cutTime > self.LINKERRORTIME:
+                        break
+                elif cutTime is not None:
+                    cutTime = None
+                    self.condition.notify_all()  # the held packets can be received
+                while self.toDrone and self.toDrone[0][0] <= now and not isCut:
+                    for answer in self.firmware.handle(heapq.heappop(self.toDrone)[2], now):
+                        self._enqueue(self.toHost, "toHost", answer)
+                for pk in self.firmware.poll(now):
+                    self._enqueue(self.toHost, "toHost", pk)
+                nextTime = min(self.toDrone[0][0] if self.toDrone and not isCut else math.inf, self.firmware.nextLogTime(), now + 0.1)
+                self.condition.wait(max(nextTime - time.monotonic(), 0))
+        # outside of the condition, cflib closes the link from the callback
+        if self.isRunning and self.linkErrorCallback is not None:
+            self.linkErrorCallback("Too many packets lost")
+
+
+    def close(self):
+        with self.condition:
+            self.isRunning = False
+            self.condition.notify_all()
+
+
+    def get_status(self):
+        return "Simulated"
+
+
+    def get_name(self):
+        return "loopback"
+
+
+    def scan_interface(self, address=None):
+        return [[uri, ""] for uri in self.startPositions]
+
+
+    def enum(self):
+        return None
+
+
+    def get_help(self):
+        return "loopback://<dongle>/<channel>/<datarate>/<address>, a simulated Crazyflie"
+
+
+def registerLoopbackDriver(latencyMilli=None, jitterMilli=None, lossProbability=None, startPositions=None):
+    """Lets cflib open the uris starting with loopback://, e.g. loopback://0/80/2M/E7E7E7E7E0, as simulated drones.
+        Can be called again to change the configuration of the links opened from then on, the settings which are None are kept."""
+    if latencyMilli is not None:
+        LoopbackDriver.latencyMilli = latencyMilli
+    if jitterMilli is not None:
+        LoopbackDriver.jitterMilli = jitterMilli
+    if lossProbability is not None:
+        LoopbackDriver.lossProbability = lossProbability
+    if startPositions is not None:
+        LoopbackDriver.startPositions.update(startPositions)
+
+    # cflib versions keep their drivers differently, wrapping get_link_driver works with all of them
+    if getattr(cflib.crtp.get_link_driver, "supportsLoopback", False):
+        return
+    getLinkDriver = cflib.crtp.get_link_driver
+
+    def get_link_driver(uri, *args, **kwargs):
+        if uri.startswith(SCHEME):
+            driver = LoopbackDriver()
+            driver.connect(uri, *args, **kwargs)
+            return driver
+        return getLinkDriver(uri, *args, **kwargs)
+
+    get_link_driver.supportsLoopback = True
+    cflib.crtp.get_link_driver = get_link_driver
@@ -0,0 +1,202 @@
+import numpy as np
+
+from panda3d.core import Vec3
+from panda3d.bullet import BulletSphereShape
+from panda3d.bullet import BulletRigidBodyNode
+
+
+class BulletPhysics:
+    """Simulates every drone as a damped rigid sphere in the Bullet world."""
+
+    def __init__(self, world):
+        self.world = world
+        self.swarm = None
+        self.bodies = []  # the BulletBody of every drone, in the same order as the arrays of the swarm engine
+
+
+    def attach(self, swarm):
+        """Called by the swarm engine, Bullet keeps the state in its own bodies and copies it to the swarm arrays on demand."""
+        self.swarm = swarm
+
+
+    def createBody(self, base, drone, position: Vec3):
+        body = BulletBody(base, self.world, drone, position)
+        self.swarm.positions[drone.index] = position  # so the drone is in the right place before the first step
+        self.bodies.append(body)
+        return body
+
+
+    def step(self, dt):
+        """Advances the physics by exactly one step."""
+        self.world.doPhysics(dt, 1, dt)
+
+
+    def gatherPositions(self, swarm):
+        """Copies the positions of all bullet bodies into the positions array of the swarm in a single sweep."""
+        for i, body in enumerate(self.bodies):
+            swarm.positions[i] = body.nodePath.getPos()
+
+
+    def gatherVelocities(self, swarm):
+        """Copies the velocities of all bullet bodies into the velocities array of the swarm in a single sweep."""
+        for i, body in enumerate(self.bodies):
+            swarm.velocities[i] = body.rigidBody.getLinearVelocity()
+
+
+    def applyForces(self, swarm):
+        """Replaces the forces of all active bullet bodies with the forces of the swarm in a single sweep.
+            Bullet clears the forces after each step, so settled drones don't need to be touched."""
+        for i in np.flatnonzero(swarm.active[:swarm.count]):
+            body = self.bodies[i]
+            body.rigidBody.clearForces()
+            body.rigidBody.applyCentralForce(Vec3(*swarm.forces[i]))
+
+
+    def syncNodes(self):
+        """Bullet moves the nodes of the bodies by itself."""
+        pass
+
+
+class BulletBody:
+    """The rigid body of a drone, which has a mass and linear damping."""
+
+    def __init__(self, base, world, drone, position: Vec3):
+        self.rigidBody = BulletRigidBodyNode("RigidSphere")  # derived from PandaNode
+        self.rigidBody.setMass(drone.RIGIDBODYMASS)  # body is now dynamic
+        self.rigidBody.addShape(BulletSphereShape(drone.RIGIDBODYRADIUS))
+        self.rigidBody.setLinearSleepThreshold(0)
+        self.rigidBody.setFriction(0)
+        self.rigidBody.setLinearDamping(drone.LINEARDAMPING)
+        self.nodePath = base.render.attachNewNode(self.rigidBody)
+        self.nodePath.setPos(position)
+        # self.nodePath.setCollideMask(BitMask32.bit(1))
+        world.attach(self.rigidBody)
+
+    def getPos(self) -> Vec3:
+        return self.nodePath.getPos()
+
+    def setPos(self, position: Vec3):
+        self.nodePath.setPos(position)
+
+    def getVel(self) -> Vec3:
+        return self.rigidBody.getLinearVelocity()
+
+    def setVel(self, velocity: Vec3):
+        self.rigidBody.setLinearVelocity(velocity)
+
+    def applyCentralForce(self, force: Vec3):
+        self.rigidBody.applyCentralForce(force)
+
+    def clearForces(self):
+        self.rigidBody.clearForces()
+
+    def getTotalForce(self) -> Vec3:
+        return self.rigidBody.getTotalForce()
+
+
+class PointMassPhysics:
+    """Simulates the drones as damped point masses directly on the arrays of the swarm engine, without any Bullet bodies.
+        Integrates the same way Bullet does: damping, then the forces, then the position (semi-implicit euler).
+        The drones are kept above the ground plane, just like the ground body of the Bullet world does.
+        Bullet reports the positions of its bodies one step late (motion state interpolation), so its trajectories lag one step behind."""
+
+    def __init__(self, groundHeight=0):
+        self.groundHeight = groundHeight
+        self.swarm = None
+        self.bodies = []
+        self.shards = None  # if set, the point masses are integrated by the worker processes of the SwarmShards
+
+
+    def attach(self, swarm):
+        """Called by the swarm engine, the state of the point masses is stored in its arrays."""
+        self.swarm = swarm
+
+
+    def createBody(self, base, drone, position: Vec3):
+        # the node is only needed to show a model of this drone, it is moved along with the point mass once per frame
+        needsNode = drone.hasOwnModel or (drone.printDebugInfo and not drone.isHeadless)
+        nodePath = base.render.attachNewNode("PointMass") if needsNode else None
+        body = PointMassBody(self.swarm, drone.index, nodePath)
+        body.setPos(position)
+        self.bodies.append(body)
+        return body
+
+
+    def step(self, dt):
+        """Advances all point masses by one step."""
+        if self.shards is not None:
+            self.shards.integrate(dt)
+            return
+        n = self.swarm.count
+        integratePointMasses(self.swarm.positions[:n], self.swarm.velocities[:n], self.swarm.forces[:n], dt, self.swarm.droneClass, self.groundHeight)
+
+
+    def gatherPositions(self, swarm):
+        """The positions are already stored in the swarm arrays."""
+        pass
+
+
+    def gatherVelocities(self, swarm):
+        """The velocities are already stored in the swarm arrays."""
+        pass
+
+
+    def applyForces(self, swarm):
+        """The forces are read directly from the swarm arrays in the next step."""
+        pass
+
+
+    def syncNodes(self):
+        """Moves the nodes of the drone models to the positions of the point masses."""
+        positions = self.swarm.positions
+        for i, body in enumerate(self.bodies):
+            if body.nodePath is not None:
+                body.nodePath.setPos(*positions[i])
+
+
+def integratePointMasses(positions, velocities, forces, dt, droneClass, groundHeight):
+    """Advances the point masses with the supplied arrays by one step, the arrays are modified in place."""
+    velocities *= (1 - droneClass.LINEARDAMPING) ** dt
+    velocities += forces * (dt / droneClass.RIGIDBODYMASS)
+    positions += velocities * dt
+
+    # the spheres rest on the ground plane instead of falling through it
+    minHeight = groundHeight + droneClass.RIGIDBODYRADIUS
+    belowGround = positions[:, 2] < minHeight
+    positions[belowGround, 2] = minHeight
+    velocities[belowGround, 2] = np.maximum(velocities[belowGround, 2], 0)
+
+    # like Bullet, the forces only act for a single step
+    forces[:] = 0
+
+
+class PointMassBody:
+    """The body of a drone simulated by PointMassPhysics, offers the same methods as BulletBody."""
+
+    def __init__(self, swarm, index, nodePath):
+        self.swarm = swarm
+        self.index = index
+        self.nodePath = nodePath  # None in headless mode
+
+    def getPos(self) -> Vec3:
+        return Vec3(*self.swarm.positions[self.index])
+
+    def setPos(self, position: Vec3):
+        self.swarm.positions[self.index] = position
+        if self.nodePath is not None:
+            self.nodePath.setPos(position)
+
+    def getVel(self) -> Vec3:
+        return Vec3(*self.swarm.velocities[self.index])
+
+    def setVel(self, velocity: Vec3):
+        self.swarm.velocities[self.index] = velocity
+
+    def applyCentralForce(self, force: Vec3):
+        self.swarm.forces[self.index] += force
+
+    def clearForces(self):
+        self.swarm.forces[self.index] = 0
+
+    def getTotalForce(self) -> Vec3:
+        return Vec3(*self.swarm.forces[self.index])
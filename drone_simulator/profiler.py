@@ -0,0 +1,165 @@
+import os
+import sys
+import csv
+import json
+import time
+import datetime
+import contextlib
+from collections import deque
+
+import numpy as np
+
+from direct.showbase import DirectObject
+from direct.gui.OnscreenText import OnscreenText
+from panda3d.core import TextNode
+
+
+class FrameProfiler(DirectObject.DirectObject):
+    """Measures how much time each task and each phase of the drone update takes per frame.
+        Shows the rolling median and 99th percentile in an overlay (toggled with p) and exports the statistics when the simulator exits.
+        When disabled, all methods return immediately so the profiler can stay in the code."""
+
+    WINDOW = 300  # the amount of frames the rolling statistics are computed over
+    OVERLAYINTERVAL = 0.5  # seconds between overlay updates
+
+    def __init__(self, base, enabled=False):
+        self.base = base
+        self.enabled = enabled
+        self.current = {}  # name: the time measured in the current frame
+        self.samples = {}  # name: the times of the last WINDOW frames
+        self.totals = {}  # name: [frames, total time, max time] over the whole run
+        self.overlay = None
+        self.lastOverlayUpdate = 0
+        self.lastFrameEnd = None
+        self._nullContext = contextlib.nullcontext()
+
+        if not self.enabled:
+            return
+        self.base.taskMgr.add(self.endFrameTask, "ProfilerEndFrame", sort=1000)  # runs after all other tasks of the frame
+        self.base.finalExitCallbacks.append(self.export)
+        if self.base.win is not None:
+            font = self.base.loader.loadFont("cmtt12.egg")  # monospaced, so the columns line up
+            self.overlay = OnscreenText(text="", pos=(-1.3, 0.9), scale=0.04, fg=(1, 1, 1, 1), bg=(0, 0, 0, 0.5),
+                                        align=TextNode.ALeft, mayChange=True, font=font)
+            self.accept("p", self.toggleOverlay)
+
+
+    def add(self, name, seconds):
+        """Adds the measured time to the current frame of name."""
+        if self.enabled:
+            self.current[name] = self.current.get(name, 0) + seconds
+
+
+    def measure(self, name):
+        """Returns a context manager which adds the time spent inside it to the current frame of name."""
+        if not self.enabled:
+            return self._nullContext
+        return _Measurement(self, name)
+
+
+    def wrapTask(self, function, name):
+        """Returns the task function wrapped so that each call is measured, or the function itself when disabled."""
+        if not self.enabled:
+            return function
+
+        def wrapped(*args):
+            start = time.perf_counter()
+            result = function(*args)
+            self.add(name, time.perf_counter() - start)
+            return result
+        return wrapped
+
+
+    def endFrameTask(self, task):
+        """Moves the measurements of this frame into the statistics."""
+        now = time.perf_counter()
+        if self.lastFrameEnd is not None:
+            self.add("Frame", now - self.lastFrameEnd)
+        self.lastFrameEnd = now
+
+        for name, seconds in self.current.items():
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.WINDOW)
+                self.totals[name] = [0, 0, 0]
+            self.samples[name].append(seconds)
+            totals = self.totals[name]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+        self.current = {}
+
+        if self.overlay is not None and not self.overlay.isHidden() and now - self.lastOverlayUpdate > self.OVERLAYINTERVAL:
+            self.lastOverlayUpdate = now
+            self._updateOverlay()
+        return task.cont
+
+
+    def reset(self):
+        """Discards all measurements, e.g. after a warmup."""
+        self.current = {}
+        self.samples = {}
+        self.totals = {}
+        self.lastFrameEnd = None
+
+
+    def getStatistics(self):
+        """Returns a dict with the statistics of each measured name, all times in milliseconds."""
+        statistics = {}
+        for name, samples in self.samples.items():
+            frames, total, maximum = self.totals[name]
+            window = np.asarray(samples) * 1000
+            statistics[name] = {
+                "frames": frames,
+                "mean": total / frames * 1000,
+                "max": maximum * 1000,
+                "p50": float(np.percentile(window, 50)),
+                "p99": float(np.percentile(window, 99)),
+            }
+        return statistics
+
+
+    def export(self, path=None):
+        """Writes the statistics to path.json and path.csv, by default into the profiles folder."""
+        if not self.enabled or not self.samples:
+            return
+        if path is None:
+            directory = sys.path[0] + "/profiles"
+            os.makedirs(directory, exist_ok=True)
+            path = directory + "/profile_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        statistics = self.getStatistics()
+        with open(path + ".json", "w") as f:
+            json.dump(statistics, f, indent=2)
+        with open(path + ".csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "frames", "mean", "max", "p50", "p99"])
+            for name, values in statistics.items():
+                writer.writerow([name, values["frames"], values["mean"], values["max"], values["p50"], values["p99"]])
+        print(f"profile saved as {path}.json and .csv")
+
+
+    def toggleOverlay(self):
+        if self.overlay.isHidden():
+            self.overlay.show()
+        else:
+            self.overlay.hide()
+
+
+    def _updateOverlay(self):
+        lines = ["{:<24}{:>8}{:>8}".format("ms per frame", "p50", "p99")]
+        for name, values in sorted(self.getStatistics().items()):
+            lines.append("{:<24}{:>8.2f}{:>8.2f}".format(name, values["p50"], values["p99"]))
+        self.overlay.setText("\n".join(lines))
+
+
+class _Measurement:
+    """Context manager used by FrameProfiler.measure()."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
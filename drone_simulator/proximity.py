@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class ProximityMonitor:
+    """Counts near misses and collisions between the drones and keeps track of their closest approach.
+        All pairs within the sensor range are found with a KD-tree over the positions snapshot, which does the job of a broadphase
+        for both physics backends without a python loop. An event is counted once when a pair comes closer than the threshold,
+        not on every step it stays that close. While all drones are settled nothing can change, so nothing is checked."""
+
+    NEARMISSDISTANCE = 0.3
+
+    def __init__(self, swarm):
+        self.swarm = swarm
+        self.collisionDistance = 2 * swarm.droneClass.RIGIDBODYRADIUS  # the spheres of the drones touch
+        self.reset()
+
+
+    def reset(self):
+        """Starts counting from zero, e.g. at the start of a recording."""
+        self.nearMisses = 0
+        self.collisions = 0
+        self.closestDistance = math.inf  # the closest approach of any two drones within the sensor range
+        self.events = []  # [time, drone, other drone, "nearMiss" or "collision"]
+        self.nearPairs = np.zeros(0, dtype=np.int64)  # the keys of the pairs that are currently closer than NEARMISSDISTANCE
+        self.collidingPairs = np.zeros(0, dtype=np.int64)
+
+
+    def update(self, time):
+        """Checks all pairs of drones for near misses and collisions."""
+        n = self.swarm.count
+        if not np.any(self.swarm.active[:n]):
+            return
+        positions = self.swarm.positions[:n]
+        pairs = cKDTree(positions).query_pairs(self.swarm.droneClass.SENSORRANGE, output_type="ndarray")  # i < j for every pair
+        i, j = pairs[:, 0], pairs[:, 1]
+        dist = np.linalg.norm(positions[j] - positions[i], axis=1)
+        if len(dist) > 0:
+            self.closestDistance = min(self.closestDistance, float(dist.min()))
+
+        keys = i * n + j
+        self.nearPairs = self._countNewPairs(keys[dist < self.NEARMISSDISTANCE], self.nearPairs, n, time, "nearMiss")
+        self.collidingPairs = self._countNewPairs(keys[dist < self.collisionDistance], self.collidingPairs, n, time, "collision")
+
+
+    def _countNewPairs(self, keys, previousKeys, n, time, kind) -> np.ndarray:
+        """Counts the pairs that were not close on the last check and returns all close pairs."""
+        newKeys = np.setdiff1d(keys, previousKeys, assume_unique=True)
+        if kind == "nearMiss":
+            self.nearMisses += len(newKeys)
+        else:
+            self.collisions += len(newKeys)
+        for key in newKeys:
+            self.events.append([time, int(key // n), int(key % n), kind])
+        return keys
+
+
+    def getStatistics(self) -> dict:
+        """Returns the counts and the closest approach in meters, which is None if no two drones came within the sensor range."""
+        return {
+            "nearMisses": self.nearMisses,
+            "collisions": self.collisions,
+            "closestDistance": None if self.closestDistance == math.inf else self.closestDistance,
+            "events": self.events,
+        }
@@ -1,11 +1,14 @@
 import os
 import sys
+import json
+import time
 import numpy as np
-import datetime
 from direct.showbase import DirectObject
 
 class DroneRecorder(DirectObject.DirectObject):
 
+    RECORDINGINTERVAL = 0.05  # seconds of simulated time between two recorded positions
+
     def __init__(self, droneManager, delay):
         self.droneManager = droneManager
         self.recordingLstPos = []
@@ -13,61 +16,67 @@ class DroneRecorder(DirectObject.DirectObject):
         self.isRecording = False
         self.accept('space', self.toggleRecording)
         self.recordVelocity = True
+        self.startTime = None  # the time.monotonic() at which the recording started, to find the telemetry of the real drones
 
-        self.now = datetime.datetime.now()
-        self.prev = datetime.datetime.now()
-        self.tAccum = 0
-        self.amount = 0
-        self.deltaAvgDelay = 0
         self.delay = delay
         self.run = 0
+        self.outputDir = sys.path[0] + "/trajectories"  # recordings are saved to outputDir/{drones}quads/{delay}/
 
 
     def recordDronesTask(self, task):
-        self.now = datetime.datetime.now()
-        delta = self.now - self.prev
-        if self.deltaAvgDelay < 10:
-            self.deltaAvgDelay += 1
-        else:
-            self.tAccum += delta.total_seconds()
-            self.amount += 1
-            print(self.tAccum / self.amount)
-        self.prev = datetime.datetime.now()
-
-        task.delayTime = 0.05
+        """Records the drones every RECORDINGINTERVAL seconds of simulated time, use the profiler to see how long recording takes."""
+        task.delayTime = self.RECORDINGINTERVAL
         self.recordingLstPos.append(self.droneManager.getAllPositions())
         if self.recordVelocity:
             self.recordingLstVel.append(self.droneManager.getAllVelocities())
         return task.again
 
 
-    def save(self):
-        self.run += 1
+    def save(self, run=None):
+        """Saves the recording, the run number is counted up if none is supplied."""
+        self.run = self.run + 1 if run is None else run
         # self.delay = 0
+        directory = f"{self.outputDir}/{len(self.droneManager.drones)}quads/{self.delay}"
+        os.makedirs(directory, exist_ok=True)
         posTraj = np.asarray(self.recordingLstPos)
         posTraj = np.swapaxes(posTraj, 0, 1)  # make array in the shape agent, timestep, dimension
-        np.save(sys.path[0] + f"/trajectories/2quads/{self.delay}/pos_traj_{self.run}.npy", posTraj)
+        np.save(directory + f"/pos_traj_{self.run}.npy", posTraj)
         if self.recordVelocity:
             velTraj = np.asarray(self.recordingLstVel)
             velTraj = np.swapaxes(velTraj, 0, 1)  # make array in the shape agent, timestep, dimension
-            np.save(sys.path[0] + f"/trajectories/2quads/{self.delay}/vel_traj_{self.run}.npy", velTraj)
-        print(f"recording saved as /{self.delay}/xxx_traj_{self.run}.npy")
+            np.save(directory + f"/vel_traj_{self.run}.npy", velTraj)
+        # the telemetry of the real drones at the rate it was received, with a timestamp per sample
+        telemetry = self.droneManager.telemetry
+        if telemetry.hasData() and self.startTime is not None:
+            np.savez(directory + f"/real_traj_{self.run}.npz", **telemetry.getWindow(self.startTime))
+        # the near misses and collisions since the recording started
+        statistics = self.droneManager.proximity.getStatistics()
+        with open(directory + f"/proximity_{self.run}.json", "w") as f:
+            json.dump(statistics, f)
+        print(f"recording saved as {directory}/xxx_traj_{self.run}.npy, {statistics['nearMisses']} near misses and {statistics['collisions']} collisions")
 
 
     def toggleRecording(self):
         if not self.isRecording:
-            print("recording started")
-            self.recordingLstPos = []
-            self.recordingLstVel = []
-            self.isRecording = True
-            self.droneManager.base.taskMgr.doMethodLater(0, self.recordDronesTask, "RecordDrones")
+            self.startRecording()
         else:
-            self.tAccum = 0
-            self.amount = 0
-            self.deltaAvgDelay = 0
+            self.stopRecording()
 
-            self.isRecording = False
-            self.droneManager.base.taskMgr.remove("RecordDrones")
-            self.save()
-            # self.recordingLst = []
-            # self.recordingLstVel = []
+
+    def startRecording(self):
+        print("recording started")
+        self.recordingLstPos = []
+        self.recordingLstVel = []
+        self.droneManager.proximity.reset()
+        self.startTime = time.monotonic()
+        self.isRecording = True
+        self.droneManager.base.simClock.doMethodLater(0, self.recordDronesTask, "RecordDrones")
+
+
+    def stopRecording(self, run=None):
+        """Stops the recording and saves it, see save()."""
+        self.isRecording = False
+        self.droneManager.base.simClock.remove("RecordDrones")
+        self.save(run)
+        # self.recordingLst = []
+        # self.recordingLstVel = []
@@ -0,0 +1,188 @@
+import atexit
+import types
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+
+import numpy as np
+
+from spatial_hash import SpatialHash
+from swarm import targetForces, avoidanceForces, clampForces, settledDrones
+from physics import PointMassPhysics, integratePointMasses
+
+
+# the swarm arrays that are moved into shared memory, the workers read and write them directly
+SHAREDARRAYS = ("ids", "positions", "velocities", "targets", "lastSentPositions", "randVecs", "forces", "active")
+# the constants of the drone class the workers need
+CONSTANTS = ("SENSORRANGE", "FORCEFALLOFFDISTANCE", "TARGETFORCE", "AVOIDANCEFORCE", "LINEARDAMPING", "RIGIDBODYMASS", "RIGIDBODYRADIUS")
+
+# commands written to the control array
+STOP = 0
+INTEGRATE = 1
+FORCES = 2
+
+
+class SwarmShards:
+    """Partitions the drones by spatial region across worker processes, which integrate the point masses and compute the forces
+        of their own drones. All swarm arrays live in shared memory: each worker writes only the rows of its own drones and reads the
+        last sent positions of the drones of other partitions within SENSORRANGE of its drones (the halo) directly from the shared arrays.
+        The main process keeps running the tasks, the rendering and the recorder on the same arrays between the steps.
+        Requires the numpy physics backend and no channel simulator, and no drones can be added once the workers are running."""
+
+    REPARTITIONINTERVAL = 60  # steps between two repartitions, the drones move between the regions in the meantime
+
+    def __init__(self, swarm, physics, workerCount):
+        if not isinstance(physics, PointMassPhysics):
+            raise ValueError("Sharding requires the numpy physics backend")
+        if swarm.channel is not None:
+            raise ValueError("Sharding does not support a channel simulator")
+        self.swarm = swarm
+        self.physics = physics
+        self.workerCount = workerCount
+        self.stepsSincePartition = self.REPARTITIONINTERVAL
+        n = swarm.count
+
+        # move the swarm arrays into shared memory, the swarm and everything reading from it keeps working on the same arrays
+        self.sharedMemory = []
+        names = {}
+        for name in SHAREDARRAYS:
+            array = getattr(swarm, name)[:n]
+            setattr(swarm, name, self._share(array, name, names))
+        self.shardOf = self._share(np.zeros(n, dtype=int), "shardOf", names)  # the partition each drone belongs to
+        self.control = self._share(np.zeros(3), "control", names)  # the command, the step size and the trackActivity of the swarm
+
+        constants = {name: getattr(swarm.droneClass, name) for name in CONSTANTS}
+        context = multiprocessing.get_context("spawn")  # the workers must not inherit the state of panda3d
+        self.barrier = context.Barrier(workerCount + 1)
+        self.workers = []
+        for shardIndex in range(workerCount):
+            worker = context.Process(target=_runWorker, args=(shardIndex, names, constants, physics.groundHeight, self.barrier), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        self.partition()
+        swarm.shards = self
+        physics.shards = self
+        atexit.register(self.stop)
+        print(f"simulating {n} drones in {workerCount} worker processes")
+
+
+    def _share(self, array, name, names):
+        """Returns a copy of the array in shared memory and stores how the workers can find it in names."""
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.sharedMemory.append(memory)
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+        shared[:] = array
+        names[name] = (memory.name, array.shape, array.dtype.str)
+        return shared
+
+
+    def partition(self):
+        """Splits the drones into slabs along the x axis with the same amount of drones each."""
+        order = np.argsort(self.swarm.positions[:, 0], kind="stable")
+        self.shardOf[order] = np.arange(len(order)) * self.workerCount // len(order)
+        self.stepsSincePartition = 0
+
+
+    def integrate(self, dt):
+        """Lets the workers advance the point masses of their drones by one step."""
+        self._run(INTEGRATE, dt)
+
+
+    def computeForces(self):
+        """Lets the workers compute the forces of their drones, repartitions the drones every REPARTITIONINTERVAL steps."""
+        if self.stepsSincePartition >= self.REPARTITIONINTERVAL:
+            self.partition()
+        self.stepsSincePartition += 1
+        self._run(FORCES, 0)
+
+
+    def _run(self, command, dt):
+        """Starts a command in all workers and waits until they are done."""
+        self.control[:] = command, dt, self.swarm.trackActivity
+        self.barrier.wait()  # start
+        self.barrier.wait()  # done
+
+
+    def stop(self):
+        """Stops the workers and moves the swarm arrays back into the memory of this process."""
+        if self.swarm.shards is not self:
+            return
+        try:
+            self.control[0] = STOP
+            self.barrier.wait(timeout=5)
+        except BrokenBarrierError:
+            pass
+        for worker in self.workers:
+            worker.join(timeout=5)
+        for name in SHAREDARRAYS:
+            setattr(self.swarm, name, getattr(self.swarm, name).copy())
+        self.shardOf = self.control = None
+        for memory in self.sharedMemory:
+            memory.close()
+            memory.unlink()
+        self.sharedMemory = []
+        self.swarm.shards = None
+        self.physics.shards = None
+        atexit.unregister(self.stop)
+
+
+def _runWorker(shardIndex, names, constants, groundHeight, barrier):
+    """The main loop of a worker process, runs the commands of the SwarmShards on the drones of one partition."""
+    droneClass = types.SimpleNamespace(**constants)
+    memories = []
+    arrays = {}
+    for name, (memoryName, shape, dtype) in names.items():
+        memory = shared_memory.SharedMemory(name=memoryName)
+        memories.append(memory)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=memory.buf)
+    positions, velocities, forces = arrays["positions"], arrays["velocities"], arrays["forces"]
+    neighborIndex = SpatialHash(droneClass.SENSORRANGE)
+
+    try:
+        while True:
+            barrier.wait()
+            command, dt, trackActivity = arrays["control"]
+            if command == STOP:
+                break
+            own = np.flatnonzero(arrays["shardOf"] == shardIndex)
+            if command == INTEGRATE:
+                ownPositions, ownVelocities, ownForces = positions[own], velocities[own], forces[own]
+                integratePointMasses(ownPositions, ownVelocities, ownForces, dt, droneClass, groundHeight)
+                positions[own], velocities[own], forces[own] = ownPositions, ownVelocities, ownForces
+            elif command == FORCES:
+                # like SwarmForceEngine.update(), settled drones get no forces
+                forces[own] = 0
+                if trackActivity:
+                    own = own[arrays["active"][own]]
+                if len(own) > 0:
+                    _computeForces(own, arrays, neighborIndex, droneClass, trackActivity)
+            barrier.wait()
+    except BrokenBarrierError:
+        pass
+    except Exception:
+        barrier.abort()  # so the main process doesn't wait forever
+        raise
+    finally:
+        for memory in memories:
+            memory.close()
+
+
+def _computeForces(own, arrays, neighborIndex, droneClass, trackActivity):
+    """Computes the forces of the supplied drones of a partition and marks the ones that settled."""
+    positions, lastSentPositions, ids = arrays["positions"], arrays["lastSentPositions"], arrays["ids"]
+    ownPositions = positions[own]
+    # the halo are all drones whose last sent position is within the sensor range of the bounding box of the own drones
+    lower = ownPositions.min(axis=0) - droneClass.SENSORRANGE
+    upper = ownPositions.max(axis=0) + droneClass.SENSORRANGE
+    local = np.flatnonzero(np.all((lastSentPositions >= lower) & (lastSentPositions <= upper), axis=1))
+    neighborIndex.rebuild(lastSentPositions[local])
+    i, j = neighborIndex.candidatePairs(ownPositions)
+    j = local[j]
+    ownForces = targetForces(ownPositions, arrays["targets"][own], droneClass)
+    avoidance = avoidanceForces(ownPositions, arrays["randVecs"][own], ids[own], i, lastSentPositions[j], ids[j], droneClass)
+    ownForces += avoidance
+    arrays["forces"][own] = clampForces(ownForces)
+    if trackActivity:
+        settled = settledDrones(ownPositions, arrays["targets"][own], arrays["velocities"][own], avoidance)
+        arrays["active"][own[settled]] = False
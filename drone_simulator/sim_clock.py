@@ -0,0 +1,113 @@
+from direct.task import Task
+
+
+class SimulationTask:
+    """Stand-in for a panda3d task that is scheduled in simulated time. Task methods written for the task manager
+        (setting task.delayTime and returning task.again, task.cont or task.done) can be scheduled on the clock unchanged."""
+
+    cont = Task.cont
+    again = Task.again
+    done = Task.done
+
+    def __init__(self, name, callback, delayTime):
+        self.name = name
+        self.callback = callback
+        self.delayTime = delayTime
+        self.wakeTime = 0  # the simulated time at which the task runs next
+
+
+class SimulationClock:
+    """A fixed-step simulation clock that drives the physics and all time based tasks from simulated time.
+        In real time mode the steps follow the wall clock, in fast forward mode the simulation runs as fast as possible.
+        Either way the results only depend on the step size, not on the frame rate."""
+
+    def __init__(self, base, stepSize=1 / 60, fastForward=False, stepsPerFrame=100, maxStepsPerFrame=10):
+        self.base = base
+        self.stepSize = stepSize
+        self.fastForward = fastForward
+        self.stepsPerFrame = stepsPerFrame  # the amount of steps per frame in fast forward mode
+        self.maxStepsPerFrame = maxStepsPerFrame  # in real time mode, the simulation slows down instead of running more steps per frame
+
+        self.simTime = 0  # the simulated time in seconds
+        self.stepCount = 0
+        self.accumulator = 0  # the wall clock time that has not yet been simulated
+
+        self.stepCallbacks = []  # list of [name, callback] which are called with the step size on every step
+        self.tasks = []  # the scheduled SimulationTasks
+
+        self.base.taskMgr.add(self.base.profiler.wrapTask(self.updateClockTask, "UpdateClock"), "UpdateClock")
+
+
+    def addStepCallback(self, callback, name):
+        """Adds a callback that is called with the step size on every step, in the order they were added."""
+        self.stepCallbacks.append([name, callback])
+
+
+    def doMethodLater(self, delayTime, callback, name):
+        """Schedules the task method callback to run after delayTime simulated seconds, like taskMgr.doMethodLater()."""
+        task = SimulationTask(name, callback, delayTime)
+        task.wakeTime = self.simTime + delayTime
+        self.tasks.append(task)
+        return task
+
+
+    def add(self, callback, name):
+        """Schedules the task method callback to run on the next step, like taskMgr.add()."""
+        return self.doMethodLater(0, callback, name)
+
+
+    def remove(self, name):
+        """Removes all scheduled tasks with the supplied name."""
+        self.tasks = [task for task in self.tasks if task.name != name]
+
+
+    def hasTask(self, name) -> bool:
+        return any(task.name == name for task in self.tasks)
+
+
+    def updateClockTask(self, task):
+        """Runs as many simulation steps as are due this frame."""
+        if self.fastForward:
+            steps = self.stepsPerFrame
+        else:
+            self.accumulator += self.base.taskMgr.globalClock.getDt()
+            steps = int(self.accumulator / self.stepSize)
+            self.accumulator -= steps * self.stepSize
+            if steps > self.maxStepsPerFrame:
+                # the simulation can't keep up with the wall clock, drop the time that can't be simulated
+                steps = self.maxStepsPerFrame
+                self.accumulator = 0
+        for _ in range(steps):
+            self.step()
+        return task.cont
+
+
+    def advance(self, duration):
+        """Runs the simulation for duration simulated seconds without waiting for any frames."""
+        endTime = self.simTime + duration
+        while self.simTime + self.stepSize / 2 < endTime:
+            self.step()
+
+
+    def step(self):
+        """Runs all due tasks and step callbacks once and advances the simulated time by one step."""
+        for task in [task for task in self.tasks if task.wakeTime <= self.simTime]:
+            self._runTask(task)
+        for name, callback in self.stepCallbacks:
+            with self.base.profiler.measure(name):
+                callback(self.stepSize)
+        self.stepCount += 1
+        self.simTime = self.stepCount * self.stepSize  # multiplying instead of summing keeps the time free of rounding drift
+
+
+    def _runTask(self, task):
+        if task not in self.tasks:  # the task has been removed by another task in this step
+            return
+        with self.base.profiler.measure(task.name):
+            result = task.callback(task)
+        if result == Task.again:
+            task.wakeTime += task.delayTime
+        elif result == Task.cont:
+            task.wakeTime = self.simTime + self.stepSize
+        else:
+            self.tasks.remove(task)
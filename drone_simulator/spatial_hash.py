@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class SpatialHash:
+    """A uniform grid over a set of points, used to find all points that might be within the cell size of a query point.
+        The grid is stored as the packed cell keys of all points in sorted order, so both building and querying it are vectorized."""
+
+    # the 27 cell offsets that make up the neighborhood of a cell, including the cell itself
+    NEIGHBOROFFSETS = np.array([[x, y, z] for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.sortedKeys = np.zeros(0, dtype=np.int64)  # the cell keys of all points, in ascending order
+        self.sortedIndices = np.zeros(0, dtype=np.int64)  # the index of the point belonging to each entry of sortedKeys
+
+
+    def rebuild(self, positions: np.ndarray):
+        """Rebuilds the grid from the supplied positions, the nth row belongs to the point with index n."""
+        keys = _packCells(self._cells(positions))
+        order = np.argsort(keys, kind="stable")
+        self.sortedKeys = keys[order]
+        self.sortedIndices = order
+
+
+    def query(self, point) -> np.ndarray:
+        """Returns the indices of all points in the cell of the query point and its neighboring cells."""
+        receivers, senders = self.candidatePairs(np.asarray([point], dtype=float))
+        return senders
+
+
+    def candidatePairs(self, points: np.ndarray):
+        """Returns two index arrays (queries, candidates), so that for every query point all points in its neighboring cells are listed.
+            The pairs are ordered by query index."""
+        neighborCells = self._cells(points)[:, None, :] + self.NEIGHBOROFFSETS[None, :, :]
+        keys = _packCells(neighborCells).ravel()
+        start = np.searchsorted(self.sortedKeys, keys, side="left")
+        counts = np.searchsorted(self.sortedKeys, keys, side="right") - start
+
+        # expand the (start, count) ranges into one entry per candidate
+        queries = np.repeat(np.repeat(np.arange(len(points)), len(self.NEIGHBOROFFSETS)), counts)
+        rangeOffsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates = self.sortedIndices[np.repeat(start, counts) + rangeOffsets]
+        return queries, candidates
+
+
+    def _cells(self, positions: np.ndarray) -> np.ndarray:
+        """Returns the integer grid coordinates of the cells containing the positions."""
+        return np.floor(np.asarray(positions, dtype=float) / self.cellSize).astype(np.int64)
+
+
+def _packCells(cells: np.ndarray) -> np.ndarray:
+    """Packs integer cell coordinates into a single int64 key with 21 bits per axis."""
+    cells = cells + (1 << 20)
+    return (cells[..., 0] << 42) | (cells[..., 1] << 21) | cells[..., 2]
@@ -0,0 +1,206 @@
+import time
+import queue
+import threading
+
+import numpy as np
+
+
+def radioKey(uri) -> str:
+    """Returns the dongle and channel of a uri, e.g. radio://0/80 for radio://0/80/2M/E7E7E7E7E0. Drones with the same key share a radio."""
+    return "/".join(uri.split("/")[:4])
+
+
+class SetpointStreamer:
+    """Streams the setpoints to the connected real drones at a fixed rate, so the setpoint rate doesn't depend on the frame rate.
+        The drones are grouped by dongle and channel and each group is served by a RadioWorker thread of its own, so the traffic
+        to drones on different radios is issued in parallel. The simulation publishes the positions of the virtual drones on every
+        step as a new snapshot, which replaces the old one with a single assignment, so neither side ever waits for a lock.
+        Other traffic, like parameter sets, starting log blocks or stopping a drone, is submitted to the worker of a drone and is sent
+        between two ticks. Only opening a link isn't, cflib downloads the TOCs in its own threads and blocks until they are known.
+        A setpoint is only sent if it moved more than threshold from the last one sent to the drone, or if nothing was sent to the
+        drone for the keepalive interval, so a hovering formation leaves the radio to the telemetry and to the drones that move."""
+
+    RATE = 50  # setpoints per second sent to each moving drone
+    THRESHOLD = 0.005  # meters a setpoint has to move before it is sent again
+    KEEPALIVE = 0.2  # seconds between setpoints for drones that don't move, the real drone stops if it gets none for too long
+    REPORTINTERVAL = 5  # seconds between two reports of missed deadlines
+
+    def __init__(self, drones, rate=RATE, threshold=THRESHOLD, keepalive=KEEPALIVE):
+        self.drones = [drone for drone in drones if drone.canConnect]
+        self.period = 1 / rate
+        self.threshold = threshold
+        self.keepalive = keepalive
+        self.snapshot = None  # the positions of all drones, never modified once published
+        self.isRunning = False
+
+        groups = {}
+        for drone in self.drones:
+            groups.setdefault(radioKey(drone.uri), []).append(drone)
+        self.workers = {key: RadioWorker(self, key, groupDrones) for key, groupDrones in groups.items()}
+
+
+    def publish(self, positions):
+        """Publishes a copy of the supplied positions of all drones as the setpoints of the next tick."""
+        self.snapshot = positions.copy()
+
+
+    def start(self):
+        """Starts streaming in the background, does nothing if it is already running."""
+        if self.isRunning:
+            return
+        self.isRunning = True
+        for worker in self.workers.values():
+            worker.start()
+
+
+    def stop(self, wait=True):
+        """Stops streaming, the workers still run the jobs that were submitted before. If wait is set, waits until they are done."""
+        self.isRunning = False
+        if wait:
+            for worker in self.workers.values():
+                worker.join()
+
+
+    def submit(self, drone, function, *args):
+        """Runs the function on the worker of the radio of the supplied drone, after the setpoints of the current tick.
+            If the worker isn't running, nothing else is sent over the radio and the function is run right away."""
+        self.workers[radioKey(drone.uri)].submit(function, args)
+
+
+    def getStatistics(self) -> dict:
+        """Returns the statistics of each radio since its last report, see RadioWorker.getStatistics()."""
+        return {key: worker.getStatistics() for key, worker in self.workers.items()}
+
+
+    def getDroneStatistics(self) -> dict:
+        """Returns the sent and suppressed setpoints of each drone since the streamer was started."""
+        return {drone.uri: {"sentSetpoints": drone.sentSetpoints, "suppressedSetpoints": drone.suppressedSetpoints} for drone in self.drones}
+
+
+class RadioWorker:
+    """Sends the setpoints of the drones on one radio at the rate of the streamer and runs the jobs submitted for them in between.
+        If a tick and the jobs take longer than one period the deadline is missed, the missed ticks are skipped instead of being
+        sent in a burst, and the misses are reported every REPORTINTERVAL seconds."""
+
+    def __init__(self, streamer, key, drones):
+        self.streamer = streamer
+        self.key = key
+        self.drones = drones
+        self.jobs = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.isAccepting = False  # true while the thread runs the submitted jobs, set under the lock
+        self.thread = None
+        self.resetStatistics()
+
+
+    def resetStatistics(self):
+        self.ticks = 0
+        self.missedDeadlines = 0
+        self.maxLateness = 0  # seconds
+        self.sentSetpoints = 0
+        self.suppressedSetpoints = 0
+        self.lastReportTime = time.monotonic()
+
+
+    def start(self):
+        self.join()  # the thread of the last session might still be running its last jobs
+        self.resetStatistics()
+        for drone in self.drones:
+            drone.sentSetpoints = 0
+            drone.suppressedSetpoints = 0
+        self.isAccepting = True
+        self.thread = threading.Thread(target=self._run, name=f"RadioWorker {self.key}", daemon=True)
+        self.thread.start()
+
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def submit(self, function, args):
+        with self.lock:
+            if self.isAccepting:
+                self.jobs.put((function, args))
+                return
+        self._runJob(function, args)
+
+
+    def _run(self):
+        nextTime = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.streamer.isRunning and self.jobs.empty():
+                    self.isAccepting = False
+                    break
+            snapshot = self.streamer.snapshot
+            if snapshot is not None and self.streamer.isRunning:
+                self._sendAll(snapshot)
+            self.ticks += 1
+            nextTime += self.streamer.period
+            self._runJobs(nextTime)
+
+            now = time.monotonic()
+            lateness = now - nextTime
+            if lateness > 0:
+                self.missedDeadlines += 1
+                self.maxLateness = max(self.maxLateness, lateness)
+                nextTime = now
+            else:
+                time.sleep(-lateness)
+
+            if now - self.lastReportTime > self.streamer.REPORTINTERVAL:
+                self._report(now)
+
+
+    def _sendAll(self, positions):
+        """Sends the setpoints of one tick that moved more than the threshold or are due as a keepalive, suppresses the others."""
+        now = time.monotonic()
+        n = len(positions)
+        distances = np.linalg.norm(positions - self.drones[0].swarm.setpoints[:n], axis=1)  # from the last setpoints sent
+        for drone in self.drones:
+            if not drone.isConnected or drone.index >= n:
+                continue
+            if distances[drone.index] <= self.streamer.threshold and now - drone.lastSendTime < self.streamer.keepalive:
+                drone.suppressedSetpoints += 1
+                self.suppressedSetpoints += 1
+                continue
+            try:
+                drone.sendPosition(positions[drone.index])
+                drone.sentSetpoints += 1
+                self.sentSetpoints += 1
+            except Exception as e:
+                if drone.isConnected:  # otherwise the link was just closed by disconnecting
+                    drone.linkHealth.sendFailures += 1
+                    print(drone.uri, "failed to send setpoint:", e)
+
+
+    def _runJobs(self, nextTime):
+        """Runs the submitted jobs until none are left or the next tick is due. Once the streamer is stopped all jobs are run."""
+        while time.monotonic() < nextTime or not self.streamer.isRunning:
+            try:
+                function, args = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            self._runJob(function, args)
+
+
+    def _runJob(self, function, args):
+        try:
+            function(*args)
+        except Exception as e:
+            print(self.key, "job failed:", e)
+
+
+    def _report(self, now):
+        if self.missedDeadlines > 0:
+            print(f"{self.key} missed {self.missedDeadlines} of {self.ticks} setpoint deadlines in the last {now - self.lastReportTime:.0f} s, "
+                  f"up to {self.maxLateness * 1000:.1f} ms late")
+        self.resetStatistics()
+
+
+    def getStatistics(self) -> dict:
+        """Returns the ticks, missed deadlines, largest lateness in seconds and sent and suppressed setpoints since the last report."""
+        return {"ticks": self.ticks, "missedDeadlines": self.missedDeadlines, "maxLateness": self.maxLateness, "sentSetpoints": self.sentSetpoints,
+                "suppressedSetpoints": self.suppressedSetpoints}
@@ -0,0 +1,211 @@
+import numpy as np
+
+
+class SwarmForceEngine:
+    """Keeps the state of all drones in contiguous numpy arrays and computes the forces acting on the whole swarm in one batched pass.
+        The forces are the same as the ones computed by Drone.updateForces(), only without the per drone python overhead.
+        Drones that have settled at their target with no other drone in range are skipped until they are woken up again."""
+
+    SETTLEDDISTANCE = 0.02  # a drone closer than this to its target, slower than SETTLEDSPEED and without neighbors is settled
+    SETTLEDSPEED = 0.02
+
+    def __init__(self, droneClass, neighborIndex, physics, profiler, capacity=16):
+        # the constants are read from the drone class so both code paths always use the same values
+        self.droneClass = droneClass
+        self.neighborIndex = neighborIndex  # a spatial hash over the last sent positions, rebuilt by the drone manager
+        self.channel = None  # if set, each drone avoids the positions it received over the simulated channel instead of the last sent positions
+        self.shards = None  # if set, the forces are computed by the worker processes of the SwarmShards
+        self.physics = physics  # the physics backend, which reads the positions and applies the forces
+        self.profiler = profiler
+
+        self.drones = []  # the drone objects, the nth drone owns the nth row of every array
+        self.count = 0
+        self.trackActivity = True  # if false, the forces of all drones are computed on every step
+
+        self.ids = np.zeros(capacity, dtype=int)
+        self.positions = np.zeros((capacity, 3))
+        self.velocities = np.zeros((capacity, 3))
+        self.targets = np.zeros((capacity, 3))
+        self.lastSentPositions = np.zeros((capacity, 3))
+        self.setpoints = np.zeros((capacity, 3))
+        self.randVecs = np.zeros((capacity, 3))
+        self.forces = np.zeros((capacity, 3))
+        self.active = np.zeros(capacity, dtype=bool)  # false for settled drones, which get no forces until they are woken up
+        self.physics.attach(self)
+
+
+    def addDrone(self, drone) -> int:
+        """Registers a drone with the engine and returns the index of the rows that hold its state."""
+        if self.shards is not None:
+            raise RuntimeError("Drones can't be added while the swarm is sharded")
+        if self.count == len(self.ids):
+            self._grow(2 * len(self.ids))
+        index = self.count
+        self.drones.append(drone)
+        self.active[index] = True
+        self.count += 1
+        return index
+
+
+    def _grow(self, capacity):
+        """Reallocates all arrays with a bigger capacity, keeping the existing rows."""
+        for name in ("ids", "positions", "velocities", "targets", "lastSentPositions", "setpoints", "randVecs", "forces", "active"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+
+    def update(self):
+        """Computes target, avoidance and clamped forces for all active drones from the positions snapshot and applies them."""
+        if self.count == 0:
+            return
+        profiler = self.profiler
+        n = self.count
+        if self.shards is not None:
+            with profiler.measure("UpdateForces/Shards"):
+                self.shards.computeForces()
+            return
+        active = self.getActiveIndices()
+        with profiler.measure("UpdateForces/Target"):
+            forces = self.computeTargetForces(active)
+        with profiler.measure("UpdateForces/Avoidance"):
+            avoidance = self.computeAvoidanceForces(active)
+            forces += avoidance
+        with profiler.measure("UpdateForces/Clamp"):
+            self.forces[:n] = 0
+            self.forces[active] = self.clampForces(forces)
+        with profiler.measure("UpdateForces/Activity"):
+            self.updateActivity(active, avoidance)
+        with profiler.measure("UpdateForces/Apply"):
+            self.applyForces()
+
+
+    def gatherState(self):
+        """Updates the positions and velocities arrays from the physics backend."""
+        self.physics.gatherPositions(self)
+        self.physics.gatherVelocities(self)
+
+
+    def getActiveIndices(self) -> np.ndarray:
+        """Returns the indices of the drones that are not settled."""
+        if not self.trackActivity:
+            return np.arange(self.count)
+        return np.flatnonzero(self.active[:self.count])
+
+
+    def updateActivity(self, indices, avoidance):
+        """Marks the drones with the supplied indices as settled if they are at their target, nearly still and no avoidance force acts on them."""
+        if not self.trackActivity:
+            return
+        settled = settledDrones(self.positions[indices], self.targets[indices], self.velocities[indices], avoidance)
+        self.active[indices[settled]] = False
+
+
+    def wake(self, index):
+        """Makes a settled drone active again, e.g. because it got a new target."""
+        self.active[index] = True
+
+
+    def wakeNeighbors(self, senders):
+        """Wakes all settled drones within the sensor range of the positions the supplied drones just sent.
+            Uses the neighbor index, so it has to be rebuilt with the sent positions first."""
+        if len(senders) == 0:
+            return
+        i, j = self.neighborIndex.candidatePairs(self.lastSentPositions[senders])
+        dist = np.linalg.norm(self.positions[j] - self.lastSentPositions[senders[i]], axis=1)
+        self.active[j[(dist < self.droneClass.SENSORRANGE) & (j != senders[i])]] = True
+
+
+    def wakeReceivers(self, receivers, positions):
+        """Wakes the settled drones among the supplied receivers that received a position within their sensor range over the channel."""
+        dist = np.linalg.norm(self.positions[receivers] - positions, axis=1)
+        self.active[receivers[dist < self.droneClass.SENSORRANGE]] = True
+
+
+    def computeTargetForces(self, indices=None) -> np.ndarray:
+        """Returns the forces which move each drone, or the drones with the supplied indices, closer to its target."""
+        if indices is None:
+            indices = np.arange(self.count)
+        return targetForces(self.positions[indices], self.targets[indices], self.droneClass)
+
+
+    def computeAvoidanceForces(self, indices=None) -> np.ndarray:
+        """Returns the forces which make each drone, or the drones with the supplied indices, avoid the last sent positions of the other drones.
+            Only the drones in neighboring cells of the neighbor index are considered. With a channel simulator, each drone
+            avoids the positions it has received instead, which are checked for all pairs."""
+        n = self.count
+        if indices is None:
+            indices = np.arange(n)
+        positions = self.positions[indices]
+        # each pair consists of a drone i and a drone j whose position as known by drone i might be within the sensor range of drone i
+        if self.channel is None:
+            i, j = self.neighborIndex.candidatePairs(positions)
+            otherPositions = self.lastSentPositions[j]
+        else:
+            receivers, j, otherPositions = self.channel.receivedPairs()
+            rows = np.full(n, -1)
+            rows[indices] = np.arange(len(indices))
+            i = rows[receivers]
+            isReceiver = i >= 0
+            i, j, otherPositions = i[isReceiver], j[isReceiver], otherPositions[isReceiver]
+        return avoidanceForces(positions, self.randVecs[indices], self.ids[indices], i, otherPositions, self.ids[j], self.droneClass)
+
+
+    def clampForces(self, forces: np.ndarray) -> np.ndarray:
+        """Clamps the total force acting on each drone, forces that are too strong are normalized."""
+        return clampForces(forces)
+
+
+    def applyForces(self):
+        """Hands the computed forces to the physics backend."""
+        self.physics.applyForces(self)
+
+
+def targetForces(positions, targets, droneClass) -> np.ndarray:
+    """Returns the forces which move the drones at the supplied positions closer to their targets."""
+    dist = targets - positions
+    length = np.linalg.norm(dist, axis=1, keepdims=True)
+    # outside of the falloff distance the force has unit length, inside it falls off linearly
+    scale = np.where(length > droneClass.FORCEFALLOFFDISTANCE, 1 / np.maximum(length, 1e-12), 1 / droneClass.FORCEFALLOFFDISTANCE)
+    return dist * scale * droneClass.TARGETFORCE
+
+
+def avoidanceForces(positions, randVecs, ids, i, otherPositions, otherIds, droneClass) -> np.ndarray:
+    """Returns the forces which make the drones at the supplied positions avoid other drones. Each pair consists of the
+        drone with the index i and another drone with the position otherPositions and the id otherIds."""
+    sensorRange = droneClass.SENSORRANGE
+    distVec = otherPositions - positions[i]
+    dist = np.linalg.norm(distVec, axis=1)
+    nearby = (dist < sensorRange) & (ids[i] != otherIds)  # prevent drones from detecting themselves
+    i, distVec, dist = i[nearby], distVec[nearby], dist[nearby]
+
+    distMult = sensorRange - dist
+    avoidanceDirection = _normalize(randVecs[i]) * 2 - _normalize(distVec) * 10
+    avoidanceDirection = _normalize(avoidanceDirection)
+    pairForces = avoidanceDirection * (distMult * droneClass.AVOIDANCEFORCE)[:, None]
+
+    # sum up the forces of all pairs for each drone
+    forces = np.zeros((len(positions), 3))
+    for axis in range(3):
+        forces[:, axis] = np.bincount(i, weights=pairForces[:, axis], minlength=len(positions))
+    return forces
+
+
+def settledDrones(positions, targets, velocities, avoidance) -> np.ndarray:
+    """Returns for each of the supplied drones if it is at its target, nearly still and no avoidance force acts on it."""
+    dist = np.linalg.norm(targets - positions, axis=1)
+    speed = np.linalg.norm(velocities, axis=1)
+    return (dist < SwarmForceEngine.SETTLEDDISTANCE) & (speed < SwarmForceEngine.SETTLEDSPEED) & ~np.any(avoidance, axis=1)
+
+
+def clampForces(forces: np.ndarray) -> np.ndarray:
+    """Clamps the total force acting on each drone, forces that are too strong are normalized."""
+    length = np.linalg.norm(forces, axis=1, keepdims=True)
+    return np.where(length > 2, forces / np.maximum(length, 1e-12), forces)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Normalizes the vectors along the last axis. Like Vec3.normalized(), vectors of length zero are left unchanged."""
+    length = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, length, out=np.zeros_like(vectors), where=length > 0)
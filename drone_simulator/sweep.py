@@ -0,0 +1,122 @@
+"""
+Runs formation swap experiments for a grid of drone counts, timeslot lengths, formations and repetitions on all cores.
+Each run spawns virtual drones on a formation, records them while they swap to the inverse formation (the formation file
+with the _inv suffix) and saves the trajectories as trajectories/{n}quads/{delay}/pos_traj_{run}.npy, just like a
+recording started with space in the simulator. For each run the closest approach of any two drones, the near misses and
+collisions and the time until all drones reached their targets are printed. The positions can be sent over a simulated lossy radio channel, in that case
+use a separate --output directory for each channel configuration. Example:
+
+    python sweep.py --drones 2 4 8 --delays 0 20 40 60 80 100 120 --formations "{n}_circle" --runs 10
+    python sweep.py --drones 8 --delays 40 --burst 0.05 0.3 --latency 10 --jitter 5 --output trajectories_burst
+"""
+import argparse
+import itertools
+import multiprocessing
+import random
+
+import numpy as np
+
+from panda3d.core import Vec3
+
+from channel import BernoulliLoss, GilbertElliottLoss, GaussianLatency, ChannelSimulator
+from formations.formation_ui_element import loadFormations
+
+
+COMPLETIONDISTANCE = 0.1  # a drone closer than this to its target counts as arrived
+
+
+def makeChannel(swarm, channelConfig):
+    """Creates a ChannelSimulator from a dict with the optional keys loss, burst, latency, jitter and range, see the command line arguments."""
+    lossModel = None
+    if channelConfig.get("burst") is not None:
+        lossModel = GilbertElliottLoss(*channelConfig["burst"])
+    elif channelConfig.get("loss"):
+        lossModel = BernoulliLoss(channelConfig["loss"])
+    latencyModel = GaussianLatency(channelConfig.get("latency", 0), channelConfig.get("jitter", 0))
+    return ChannelSimulator(swarm, lossModel, latencyModel, channelConfig.get("range"))
+
+
+def runScenario(droneCount, delay, formationName, run, duration, outputDir, physicsBackend="bullet", channelConfig=None):
+    """Runs a single formation swap in a headless simulator and saves the recorded trajectories. Only one simulator
+        can exist per process, so this has to run in a fresh process. If channelConfig is supplied, the positions are
+        sent over a simulated channel, see makeChannel(). Returns the scenario, the proximity statistics of the run and the
+        completion time in seconds, which is None if the drones did not all arrive."""
+    from drone_simulator import DroneSimulator
+
+    formationName = formationName.format(n=droneCount)
+    formations = {name: positions for name, positions in loadFormations()}
+    if formationName not in formations or formationName + "_inv" not in formations:
+        raise ValueError(f"The formations {formationName} and {formationName}_inv are required for a swap")
+    startPositions = formations[formationName]
+    endPositions = formations[formationName + "_inv"]
+    if len(startPositions) != droneCount or len(endPositions) != droneCount:
+        raise ValueError(f"The formation {formationName} does not contain {droneCount} points")
+
+    # every run gets its own seed so the whole sweep is reproducible
+    random.seed(f"{droneCount}-{delay}-{formationName}-{run}")
+
+    droneList = [[Vec3(*position), "-1"] for position in startPositions]
+    app = DroneSimulator(droneList, headless=True, fastForward=True, timeslotLengthMilli=delay, physicsBackend=physicsBackend)
+    manager = app.droneManager
+    manager.isStarted = True
+    for drone in manager.drones:
+        drone.lastSentPosition = drone.getPos()
+    manager.updateNeighborIndex()
+    if channelConfig is not None:
+        manager.setChannel(makeChannel(manager.swarm, channelConfig))
+
+    recorder = app.droneRecorder
+    if outputDir is not None:
+        recorder.outputDir = outputDir
+    recorder.startRecording()
+    manager.applyFormation([formationName + "_inv", endPositions.copy()])
+    app.simClock.advance(duration)
+    positions = np.asarray(recorder.recordingLstPos)  # timestep, drone, dimension
+    recorder.stopRecording(run)
+
+    proximity = manager.proximity.getStatistics()
+    del proximity["events"]
+    arrived = np.all(np.linalg.norm(positions - endPositions, axis=2) < COMPLETIONDISTANCE, axis=1)
+    completionTime = np.argmax(arrived) * recorder.RECORDINGINTERVAL if np.any(arrived) else None
+    return droneCount, delay, formationName, run, proximity, completionTime
+
+
+def _runScenarioArgs(args):
+    return runScenario(*args)
+
+
+def runSweep(droneCounts, delays, formationNames, runs, duration=10, outputDir=None, processes=None, physicsBackend="bullet", channelConfig=None):
+    """Runs all combinations of drone counts, timeslot lengths, formations and runs 1 to runs in a process pool."""
+    scenarios = [(n, delay, formation, run, duration, outputDir, physicsBackend, channelConfig)
+                 for n, delay, formation, run in itertools.product(droneCounts, delays, formationNames, range(1, runs + 1))]
+    print(f"running {len(scenarios)} scenarios")
+
+    # each process only runs one scenario, because panda3d only allows one ShowBase per process
+    with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+        for i, result in enumerate(pool.imap_unordered(_runScenarioArgs, scenarios)):
+            n, delay, formation, run, proximity, completionTime = result
+            completion = "not completed" if completionTime is None else f"completed after {completionTime:.2f} s"
+            approach = "" if proximity["closestDistance"] is None else f", closest approach {proximity['closestDistance']:.3f} m"
+            print(f"{i + 1}/{len(scenarios)} done: {n} drones, delay {delay}, {formation}, run {run}{approach}, "
+                  f"{proximity['nearMisses']} near misses, {proximity['collisions']} collisions, {completion}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drones", type=int, nargs="+", default=[2], help="the drone counts")
+    parser.add_argument("--delays", type=int, nargs="+", default=[120], help="the timeslot lengths in milliseconds")
+    parser.add_argument("--formations", nargs="+", default=["{n}_circle"], help="the start formations, {n} is replaced with the drone count")
+    parser.add_argument("--runs", type=int, default=10, help="the amount of repetitions of each combination")
+    parser.add_argument("--duration", type=float, default=10, help="the recorded simulated time of each run in seconds")
+    parser.add_argument("--output", default=None, help="the trajectory directory, defaults to the trajectories folder")
+    parser.add_argument("--physics", choices=["bullet", "numpy"], default="bullet", help="the physics backend")
+    parser.add_argument("--processes", type=int, default=None, help="the amount of worker processes, defaults to all cores")
+    parser.add_argument("--loss", type=float, default=None, help="simulate a channel that loses each packet with this probability")
+    parser.add_argument("--burst", type=float, nargs=2, default=None, metavar=("P_GOOD_TO_BAD", "P_BAD_TO_GOOD"), help="simulate a channel with burst losses instead")
+    parser.add_argument("--latency", type=float, default=None, help="simulate a channel with this mean latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=None, help="the standard deviation of the latency in milliseconds")
+    parser.add_argument("--range", type=float, default=None, help="simulate a channel with this range in meters")
+    args = parser.parse_args()
+
+    channelConfig = {key: value for key, value in vars(args).items() if key in ("loss", "burst", "latency", "jitter", "range") and value is not None}
+    runSweep(args.drones, args.delays, args.formations, args.runs, args.duration, args.output, args.processes, args.physics, channelConfig or None)
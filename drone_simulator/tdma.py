@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class TdmaSchedule:
+    """Models the time division multiple access scheme the drones use to broadcast their positions.
+        Time is divided into slots of slotLengthMilli, followed by a guard time in which nobody sends. At the start of each slot
+        all drones assigned to it send their position at once. By default there is one slot per drone, assigned in spawn order."""
+
+    def __init__(self, swarm, slotLengthMilli, guardTimeMilli=0, slotCount=None):
+        self.swarm = swarm
+        self.slotLengthMilli = slotLengthMilli
+        self.guardTimeMilli = guardTimeMilli
+        self.slotCount = slotCount  # None means one slot per drone
+        self.currentSlot = 0
+        self.slotOverrides = {}  # drone index: slot, for drones that don't use the default assignment
+        self.channel = None  # the channel simulator that delivers the sent positions, None means every drone receives them instantly
+
+
+    def getSlotCount(self) -> int:
+        if self.slotCount is None:
+            return max(1, self.swarm.count)
+        return self.slotCount
+
+
+    def getSlotDuration(self) -> float:
+        """Returns the time from the start of one slot to the start of the next one in seconds."""
+        return (self.slotLengthMilli + self.guardTimeMilli) / 1000
+
+
+    def getFramePeriod(self) -> float:
+        """Returns the time in seconds until every slot had its turn, which is the maximum age of a received position."""
+        return self.getSlotCount() * self.getSlotDuration()
+
+
+    def assignSlot(self, index, slot):
+        """Assigns the drone with the supplied index to a slot, several drones can share a slot.
+            Raises a ValueError for a slot that doesn't exist, a drone in it would never send."""
+        if not 0 <= slot < self.getSlotCount():
+            raise ValueError(f"Slot {slot} does not exist, there are {self.getSlotCount()} slots")
+        self.slotOverrides[index] = slot
+
+
+    def getSlots(self) -> np.ndarray:
+        """Returns the slot of each drone."""
+        slots = np.arange(self.swarm.count) % self.getSlotCount()
+        for index, slot in self.slotOverrides.items():
+            if index < len(slots):
+                slots[index] = slot
+        return slots
+
+
+    def advance(self, time) -> np.ndarray:
+        """Moves on to the next slot and lets the drones assigned to it send their positions at the supplied simulated time.
+            Returns the indices of the drones that sent."""
+        self.currentSlot = (self.currentSlot + 1) % self.getSlotCount()
+        return self.transmit(self.currentSlot, time)
+
+
+    def transmit(self, slot, time) -> np.ndarray:
+        """Updates the last sent positions of all drones in the supplied slot from the positions snapshot in a single step and hands them to the channel.
+            Returns the indices of the drones that sent."""
+        n = self.swarm.count
+        sending = self.getSlots() == slot
+        self.swarm.lastSentPositions[:n][sending] = self.swarm.positions[:n][sending]
+        senders = np.flatnonzero(sending)
+        if self.channel is not None:
+            self.channel.transmit(senders, time)
+        return senders
@@ -0,0 +1,186 @@
+import math
+
+import numpy as np
+
+from cflib.crazyflie.log import LogConfig
+
+from streaming import radioKey
+
+
+# the log variables the store knows, the velocity is the one of the kalman filter in the body frame of the drone
+POSITIONVARIABLES = ("kalman.stateX", "kalman.stateY", "kalman.stateZ")
+VELOCITYVARIABLES = ("kalman.statePX", "kalman.statePY", "kalman.statePZ")
+VARIANCEVARIABLES = ("kalman.varPX", "kalman.varPY", "kalman.varPZ")
+BATTERYVARIABLES = ("pm.vbat",)
+
+LOGPAYLOAD = 26  # bytes of a log packet that are left for the values, after the block id and the timestamp
+FLOATSIZE = 4
+
+
+class TelemetryRing:
+    """The newest samples of one quantity, e.g. the position, of all real drones. Each drone has a row of preallocated slots
+        that is overwritten from its oldest sample on once it is full, so the memory stays the same however long a session takes.
+        Samples are written in the order of their timestamps, which lets the windowed queries use a binary search."""
+
+    def __init__(self, rows, length, width):
+        self.length = length
+        self.times = np.full((rows, length), np.nan)
+        self.values = np.zeros((rows, length, width))
+        self.counts = np.zeros(rows, dtype=np.int64)  # the samples written to each row so far
+
+
+    def write(self, row, time, values):
+        """Writes a sample into the next slot of the row, nothing is allocated."""
+        slot = self.counts[row] % self.length
+        self.values[row, slot] = values
+        self.times[row, slot] = time
+        self.counts[row] += 1  # last, so a reader in another thread never sees a half written sample
+
+
+    def latest(self, row):
+        """Returns the time and the values of the newest sample of the row, or None if nothing was written yet."""
+        count = self.counts[row]
+        if count == 0:
+            return None
+        slot = (count - 1) % self.length
+        return float(self.times[row, slot]), self.values[row, slot].copy()
+
+
+    def latestAll(self):
+        """Returns the times and values of the newest samples of all rows, the time of rows without samples is nan."""
+        slots = (self.counts - 1) % self.length
+        rows = np.arange(len(self.counts))
+        times = np.where(self.counts > 0, self.times[rows, slots], np.nan)
+        return times, self.values[rows, slots]
+
+
+    def window(self, row, start, end=math.inf):
+        """Returns the times and the values of all samples of the row from start to end, ordered by time."""
+        count = int(self.counts[row])
+        if count <= self.length:
+            segments = [slice(0, count)]
+        else:  # the oldest sample is in the slot that is written next
+            head = count % self.length
+            segments = [slice(head, self.length), slice(0, head)]
+
+        times = []
+        values = []
+        for segment in segments:
+            segmentTimes = self.times[row, segment]
+            first = np.searchsorted(segmentTimes, start, side="left")
+            last = np.searchsorted(segmentTimes, end, side="right")
+            times.append(segmentTimes[first:last])
+            values.append(self.values[row, segment][first:last])
+        return np.concatenate(times), np.concatenate(values)
+
+
+class TelemetryStore:
+    """Holds the telemetry of all real drones of the swarm in TelemetryRings: the position and optionally the velocity and
+        the battery voltage and the variance of the position estimate, each with the time.monotonic() at which it was received.
+        The log callbacks of the drones write directly into the rings. Each drone that can connect gets a row, which is stored as its telemetryRow."""
+
+    LENGTH = 4096  # samples kept per drone and quantity, about 3 minutes of positions at a log period of 50 ms
+
+    def __init__(self, drones, length=LENGTH, velocity=True, battery=True, variance=True):
+        self.drones = [drone for drone in drones if drone.canConnect]
+        for row, drone in enumerate(self.drones):
+            drone.telemetryRow = row
+        rows = len(self.drones)
+        self.positions = TelemetryRing(rows, length, 3)
+        self.velocities = TelemetryRing(rows, length, 3) if velocity else None
+        self.battery = TelemetryRing(rows, length, 1) if battery else None
+        self.variances = TelemetryRing(rows, length, 3) if variance else None
+
+
+    def writeLog(self, row, time, data):
+        """Writes the known variables of a log packet, a packet may contain any of the quantities."""
+        if POSITIONVARIABLES[0] in data:
+            self.positions.write(row, time, (data[POSITIONVARIABLES[0]], data[POSITIONVARIABLES[1]], data[POSITIONVARIABLES[2]]))
+        if self.velocities is not None and VELOCITYVARIABLES[0] in data:
+            self.velocities.write(row, time, (data[VELOCITYVARIABLES[0]], data[VELOCITYVARIABLES[1]], data[VELOCITYVARIABLES[2]]))
+        if self.battery is not None and BATTERYVARIABLES[0] in data:
+            self.battery.write(row, time, data[BATTERYVARIABLES[0]])
+        if self.variances is not None and VARIANCEVARIABLES[0] in data:
+            self.variances.write(row, time, (data[VARIANCEVARIABLES[0]], data[VARIANCEVARIABLES[1]], data[VARIANCEVARIABLES[2]]))
+
+
+    def hasData(self) -> bool:
+        """Returns true if any position was received."""
+        return bool(np.any(self.positions.counts > 0))
+
+
+    def getWindow(self, start, end=math.inf) -> dict:
+        """Returns the samples of all drones from start to end as a dict of arrays named {quantity}_{index of the drone},
+            e.g. times_0, pos_0 and vel_0, as saved by the recorder."""
+        arrays = {}
+        for row, drone in enumerate(self.drones):
+            arrays[f"times_{drone.index}"], arrays[f"pos_{drone.index}"] = self.positions.window(row, start, end)
+            if self.velocities is not None:
+                arrays[f"veltimes_{drone.index}"], arrays[f"vel_{drone.index}"] = self.velocities.window(row, start, end)
+        return arrays
+
+
+def packLogBlocks(quantities) -> list:
+    """Packs the variables of the supplied quantities into as few log blocks as possible. The variables of a quantity stay in
+        the same block, so they always belong to the same sample. Returns a list with the variables of each block."""
+    blocks = []
+    for variables in sorted(quantities, key=len, reverse=True):  # first fit decreasing
+        for block in blocks:
+            if (len(block) + len(variables)) * FLOATSIZE <= LOGPAYLOAD:
+                block.extend(variables)
+                break
+        else:
+            blocks.append(list(variables))
+    return blocks
+
+
+class TelemetrySubscriptions:
+    """Sets up the log blocks of the real drones, which write into the TelemetryStore. The quantities that are needed often,
+        the position and velocity, are packed into the fast blocks, the variance of the estimate and the battery voltage into the
+        slow blocks. The drones on one radio share a budget of log packets per second, the slow blocks get their share first and
+        the period of the fast blocks is as short as the rest of the budget allows. So adding drones to a radio makes their
+        telemetry slower instead of saturating the link. The blocks are started by the worker of the radio of a drone, between
+        two ticks of the setpoints."""
+
+    BUDGET = 300  # log packets per second the drones on one radio may send together
+    FASTQUANTITIES = (POSITIONVARIABLES, VELOCITYVARIABLES)
+    SLOWQUANTITIES = (VARIANCEVARIABLES, BATTERYVARIABLES)
+    MINPERIOD = 20  # the fastest period of the fast blocks in milliseconds
+    MAXPERIOD = 2540  # the longest period a log block can have in milliseconds
+    SLOWPERIOD = 500  # milliseconds, the estimator waits for 10 samples of the variance
+
+    def __init__(self, store, streamer, budget=BUDGET):
+        self.store = store
+        self.streamer = streamer
+        self.budget = budget
+        self.fastBlocks = packLogBlocks(self.FASTQUANTITIES)
+        self.slowBlocks = packLogBlocks(self.SLOWQUANTITIES)
+        self.radioSizes = {}  # the amount of drones on each radio
+        for drone in store.drones:
+            self.radioSizes[radioKey(drone.uri)] = self.radioSizes.get(radioKey(drone.uri), 0) + 1
+
+
+    def getFastPeriod(self, droneCount) -> int:
+        """Returns the period of the fast blocks in milliseconds if droneCount drones share a radio."""
+        slowRate = len(self.slowBlocks) * 1000 / self.SLOWPERIOD
+        fastRate = max(self.budget / droneCount - slowRate, 0)  # packets per second left for the fast blocks of one drone
+        if fastRate == 0:
+            return self.MAXPERIOD
+        period = len(self.fastBlocks) * 1000 / fastRate
+        return min(max(math.ceil(period / 10) * 10, self.MINPERIOD), self.MAXPERIOD)  # log periods are multiples of 10 ms
+
+
+    def subscribe(self, drone, callback):
+        """Adds and starts the log blocks of the supplied drone, which has to be connected. The callback is called with every
+            log packet, like the callback of a LogConfig."""
+        fastPeriod = self.getFastPeriod(self.radioSizes[radioKey(drone.uri)])
+        configs = [(f"Fast{i}", block, fastPeriod) for i, block in enumerate(self.fastBlocks)]
+        configs += [(f"Slow{i}", block, self.SLOWPERIOD) for i, block in enumerate(self.slowBlocks)]
+        for name, variables, period in configs:
+            config = LogConfig(name=name, period_in_ms=period)
+            for variable in variables:
+                config.add_variable(variable, 'float')
+            drone.scf.cf.log.add_config(config)
+            config.data_received_cb.add_callback(callback)
+            self.streamer.submit(drone, config.start)
+        return fastPeriod
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+from panda3d.core import Vec3
+
+from drone_simulator import DroneSimulator
+from health import LinkHealthMonitor
+from loopback import LoopbackDriver
+
+
+URI = "loopback://0/80/2M/E7E7E7E7E0"
+
+
+def _stepUntil(app, condition, timeout):
+    """Runs the simulator until the condition is met, returns false if it isn't within the timeout."""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        app.taskMgr.step()
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # a cut link is noticed, and the drone reconnected, within a few seconds
+    monkeypatch.setattr(LoopbackDriver, "LINKERRORTIME", 0.3)
+    monkeypatch.setattr(LinkHealthMonitor, "LOSTAGE", 0.5)
+    monkeypatch.setattr(LinkHealthMonitor, "RETRYDELAY", 0.2)
+    monkeypatch.setattr(LoopbackDriver, "cutUris", set())
+    app = DroneSimulator([[Vec3(0, 0, 0.3), URI]], headless=True, physicsBackend="numpy")
+    yield app
+    for callback in app.finalExitCallbacks:
+        callback()
+    app.destroy()
+
+
+def test_reconnectAfterCut(app):
+    manager = app.droneManager
+    drone = manager.drones[0]
+    manager.toggleConnections({"text": ""})
+    assert _stepUntil(app, manager.connector.isDone, 20)
+    assert drone.isConnected
+
+    LoopbackDriver.cutUris.add(URI)
+    assert _stepUntil(app, lambda: drone.linkHealth.state in ("lost", "reconnecting"), 5)
+    assert not drone.isConnected
+
+    LoopbackDriver.cutUris.clear()
+    assert _stepUntil(app, lambda: drone.linkHealth.state == "ok" and drone.isConnected, 20)
+    assert drone.connectionState == "connected"
+
+
+def test_connectAfterLostDrone(app, monkeypatch):
+    manager = app.droneManager
+    drone = manager.drones[0]
+    manager.toggleConnections({"text": ""})
+    assert _stepUntil(app, manager.connector.isDone, 20)
+
+    LoopbackDriver.cutUris.add(URI)
+    assert _stepUntil(app, lambda: drone.linkHealth.state in ("lost", "reconnecting"), 5)
+    manager.toggleConnections({"text": ""})
+    LoopbackDriver.cutUris.clear()
+
+    connects = []
+    connect = drone.connect
+    monkeypatch.setattr(drone, "connect", lambda *args, **kwargs: (connects.append(args), connect(*args, **kwargs)))
+    manager.toggleConnections({"text": ""})
+    assert _stepUntil(app, manager.connector.isDone, 20)
+    _stepUntil(app, lambda: False, 1)  # the monitor would start to reconnect the drone within its retry delay
+    assert drone.isConnected
+    assert drone.linkHealth.state == "ok"
+    assert len(connects) == 1
@@ -0,0 +1,24 @@
+import types
+
+import numpy as np
+import pytest
+
+from tdma import TdmaSchedule
+
+
+def _swarm(count):
+    return types.SimpleNamespace(count=count, positions=np.zeros((count, 3)), lastSentPositions=np.zeros((count, 3)))
+
+
+def test_assignSlot():
+    tdma = TdmaSchedule(_swarm(4), slotLengthMilli=20, slotCount=2)
+    tdma.assignSlot(3, 0)
+    assert list(tdma.getSlots()) == [0, 1, 0, 0]
+
+
+@pytest.mark.parametrize("slot", [-1, 2, 5])
+def test_assignSlotOutOfRange(slot):
+    tdma = TdmaSchedule(_swarm(4), slotLengthMilli=20, slotCount=2)
+    with pytest.raises(ValueError):
+        tdma.assignSlot(0, slot)
+    assert tdma.slotOverrides == {}
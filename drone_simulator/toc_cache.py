@@ -0,0 +1,62 @@
+"""
+Keeps the log and parameter TOCs of the Crazyflies in one directory at the root of the repository, which is shared by the
+simulator and the scripts no matter from where they are started. cflib saves each TOC as a file named after its CRC, which
+only changes with the firmware, so all drones with the same firmware share the same files and only the first one has to
+download its TOCs over the radio. The cache can be populated ahead of a session, e.g. with one drone of each firmware:
+
+    python toc_cache.py radio://0/80/2M/E7E7E7E7E0
+    python toc_cache.py --list
+"""
+import os
+import glob
+import argparse
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+
+
+CACHEDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "toc_cache")
+
+
+def createCrazyflie(writable=False) -> Crazyflie:
+    """Returns a Crazyflie that reads its TOCs from the shared cache. Only a writable one saves the TOCs it had to download,
+        so drones that connect at the same time don't write the same files."""
+    if writable:
+        return Crazyflie(rw_cache=CACHEDIR)
+    return Crazyflie(ro_cache=CACHEDIR)
+
+
+def getCachedCrcs() -> list:
+    """Returns the CRCs of all cached TOCs."""
+    return sorted(int(os.path.basename(path)[:-len(".json")], 16) for path in glob.glob(os.path.join(CACHEDIR, "*.json")))
+
+
+def warmCache(uris) -> list:
+    """Connects to each of the supplied uris one after the other and saves their TOCs, returns the CRCs that were added."""
+    cached = set(getCachedCrcs())
+    for uri in uris:
+        print(uri, "fetching TOCs")
+        try:
+            with SyncCrazyflie(uri, cf=createCrazyflie(writable=True)):
+                pass
+        except Exception as e:
+            print(uri, "failed to connect:", e)
+    return [crc for crc in getCachedCrcs() if crc not in cached]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("uris", nargs="*", help="the drones to fetch the TOCs from, one per firmware is enough")
+    parser.add_argument("--list", action="store_true", help="print the CRCs of the cached TOCs")
+    args = parser.parse_args()
+
+    if args.uris:
+        cflib.crtp.init_drivers(enable_debug_driver=False)
+        added = warmCache(args.uris)
+        print(f"added {len(added)} TOCs to {CACHEDIR}")
+    if args.list or not args.uris:
+        crcs = getCachedCrcs()
+        print(f"{len(crcs)} TOCs in {CACHEDIR}")
+        for crc in crcs:
+            print(f"{crc:08X}")
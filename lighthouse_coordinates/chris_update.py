@@ -2,6 +2,7 @@ import sys
 import openvr
  
 import logging
+import os
 import time
  
 import cflib.crtp  # noqa
@@ -9,6 +10,9 @@ from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.mem import LighthouseBsGeometry
 from cflib.crazyflie.mem import MemoryElement
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+
+# the TOC cache shared with the simulator, see drone_simulator/toc_cache.py
+TOCCACHE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "toc_cache")
  
 # Only output errors from the logging framework
 logging.basicConfig(level=logging.ERROR)
@@ -117,7 +121,7 @@ class WriteMem:
     def __init__(self, uri, bs1, bs2):
         self.data_written = False
  
-        with SyncCrazyflie(uri, cf=Crazyflie(rw_cache='./cache')) as scf:
+        with SyncCrazyflie(uri, cf=Crazyflie(rw_cache=TOCCACHE)) as scf:
             mems = scf.cf.mem.get_mems(MemoryElement.TYPE_LH)
  
             count = len(mems)
@@ -35,6 +35,9 @@ from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.mem import LighthouseBsGeometry
 from cflib.crazyflie.mem import MemoryElement
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+
+# the TOC cache shared with the simulator, see drone_simulator/toc_cache.py
+TOCCACHE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "toc_cache")
 # Only output errors from the logging framework
 
 logging.basicConfig(level=logging.ERROR)
@@ -45,7 +48,7 @@ class WriteMem:
         self.data_written = False
         self.got_data = False
 
-        with SyncCrazyflie(uri, cf=Crazyflie(rw_cache='./cache')) as scf:
+        with SyncCrazyflie(uri, cf=Crazyflie(rw_cache=TOCCACHE)) as scf:
             mems = scf.cf.mem.get_mems(MemoryElement.TYPE_LH)
 
             count = len(mems)